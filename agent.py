@@ -11,10 +11,10 @@ class Agent:
      def __init__(self):
           self.messages=[]
 
-     def chat(self,prompt,web=False,rag=False,use_gpt=False,tokens=200,messages=[],quen=False):
+     def chat(self,prompt,web=False,rag=False,use_gpt=False,tokens=200,messages=[],quen=False,collection=None,instructions=None):
           context=[]
           if rag:
-               r=RAG(prompt)
+               r=RAG(prompt,collection=collection)
                context.append(r)
           if web:
                s=search(prompt,use_gpt=use_gpt)
@@ -32,13 +32,13 @@ class Agent:
           if use_gpt:
                if messages !=[]:
                     _prompt = f"{_prompt} \n\n--------Chat History: \n{str(messages)}"
-               c=gpt(_prompt)
+               c=gpt(f"{instructions}\n{_prompt}" if instructions else _prompt)
             #    print("USING CHAT GPT 4")
           else:
                if quen:
-                   c=chat(_prompt,max_new_tokens=tokens,context=messages,model_name="Qwen/Qwen3-0.6B")
+                   c=chat(_prompt,max_new_tokens=tokens,context=messages,model_name="Qwen/Qwen3-0.6B",instructions=instructions)
                else:
-                   c=chat(_prompt,max_new_tokens=tokens,context=messages)
+                   c=chat(_prompt,max_new_tokens=tokens,context=messages,instructions=instructions)
                
         
           # t=topics(c)
@@ -102,11 +102,12 @@ def autoChat(starter,instructions=None,iters=5,tokens=100,web=False,rag=False,us
         if "i require information from the web" in prompt_a.strip().replace("  "," ").lower() and web==True:
             # print("Agent searching the web.....")
             _web=True
-        prompt_a1=a.chat(base+prompt_a,web=_web,rag=_rag,tokens=tokens,messages=a1.messages,use_gpt=use_gpt,quen=True)
+        # base goes in as leading instructions, so its prefill is shared by every turn of both agents
+        prompt_a1=a.chat(prompt_a,web=_web,rag=_rag,tokens=tokens,messages=a1.messages,use_gpt=use_gpt,quen=True,instructions=base)
         if "i require information from the web" in prompt_a1.strip().replace("  "," ").lower() and web==True:
             # print("Agent 1 searching the web.....")
             _web=True
-        prompt_a=a1.chat(base+prompt_a1,web=_web,rag=_rag,tokens=tokens,messages=a.messages,use_gpt=use_gpt,quen=True)
+        prompt_a=a1.chat(prompt_a1,web=_web,rag=_rag,tokens=tokens,messages=a.messages,use_gpt=use_gpt,quen=True,instructions=base)
         # print("\nAgent A1: ",prompt_a1)
         # print("\nAgent A: ",prompt_a)
         chat_history.append({
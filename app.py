@@ -1,9 +1,18 @@
-from flask import Flask, request, jsonify, render_template_string
-from finetuned_model import chat
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
+from finetuned_model import chat, chat_stream
+from indexer import start_indexer
 import uuid
+import json
 
 app = Flask(__name__)
 
+@app.before_request
+def ensure_indexer():
+    # Documents are indexed in the background, so chat requests never wait on uploads.
+    # Started on the first request rather than at import: with debug=True the
+    # reloader's parent process imports this module too, but only the child serves.
+    start_indexer()
+
 # Store conversation history
 conversations = {}
 
@@ -390,6 +399,7 @@ HTML_TEMPLATE = """
             messageWrapper.appendChild(messageDiv);
             chatContainer.appendChild(messageWrapper);
             chatContainer.scrollTop = chatContainer.scrollHeight;
+            return messageDiv;
         }
         
         // Function to send a message
@@ -410,7 +420,7 @@ HTML_TEMPLATE = """
             chatContainer.scrollTop = chatContainer.scrollHeight;
             
             try {
-                // Send message to backend
+                // Send message to backend and render the reply as it streams in
                 const response = await fetch('/chat', {
                     method: 'POST',
                     headers: {
@@ -418,17 +428,46 @@ HTML_TEMPLATE = """
                     },
                     body: JSON.stringify({
                         message: message,
-                        session_id: sessionId
+                        session_id: sessionId,
+                        stream: true
                     }),
                 });
                 
-                const data = await response.json();
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let text = '';
+                let messageDiv = null;
+                
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    
+                    // Server-sent events are separated by a blank line
+                    const events = buffer.split('\\n\\n');
+                    buffer = events.pop();
+                    for (const event of events) {
+                        if (!event.startsWith('data: ')) continue;
+                        const data = JSON.parse(event.slice(6));
+                        if (data.error) throw new Error(data.error);
+                        if (data.token === undefined) continue;
+                        
+                        text += data.token;
+                        if (!messageDiv) {
+                            // First token: swap the typing indicator for the message
+                            typingIndicator.style.display = 'none';
+                            messageDiv = addMessage(text, false);
+                        } else {
+                            messageDiv.innerHTML = marked.parse(text);
+                            chatContainer.scrollTop = chatContainer.scrollHeight;
+                        }
+                    }
+                }
                 
                 // Hide typing indicator
                 typingIndicator.style.display = 'none';
-                
-                // Display bot response with markdown rendering
-                addMessage(data.response, false);
+                if (!messageDiv) addMessage(text, false);
             } catch (error) {
                 console.error('Error:', error);
                 typingIndicator.style.display = 'none';
@@ -469,6 +508,12 @@ def handle_chat():
     data = request.json
     message = data.get('message', '')
     session_id = data.get('session_id', str(uuid.uuid4()))
+    collection = data.get('collection')
+    if collection is not None:
+        # Queries only read the saved store; this process keeps each collection indexed
+        start_indexer(collection=collection, pin=False)
+    # Optional metadata filter, e.g. {"source": "case.pdf", "page": {"gte": 3}}
+    rag_filter = data.get('filter')
     
     # Initialize or get existing conversation
     if session_id not in conversations:
@@ -480,12 +525,46 @@ def handle_chat():
     
     # Get response from model
     context = conversations[session_id].copy()
-    response = chat(message, context=context,max_new_tokens=500,rag=True)
+    chat_args = dict(context=context, max_new_tokens=500, rag=True, collection=collection, rag_filter=rag_filter, session_id=session_id)
+    
+    if data.get('stream'):
+        # Server-sent events: {"token"} per decoded piece, then {"done", "response"}
+        def events():
+            pieces = []
+            stream = chat_stream(message, **chat_args)
+            try:
+                for piece in stream:
+                    pieces.append(piece)
+                    yield f"data: {json.dumps({'token': piece})}\n\n"
+                yield f"data: {json.dumps({'done': True, 'response': ''.join(pieces)})}\n\n"
+            except Exception as e:
+                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            finally:
+                # Also runs when the client disconnects, which stops generation
+                stream.close()
+                conversations[session_id].append({"role": "assistant", "content": "".join(pieces)})
+        
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    response = chat(message, **chat_args)
     
     # Add assistant response to context
     conversations[session_id].append({"role": "assistant", "content": response})
     
     return jsonify({"response": response})
 
+@app.route('/refresh-index', methods=['POST'])
+def refresh_index():
+    # Ask the background indexer to pick up new, changed or deleted documents now
+    indexer = start_indexer()
+    indexer.notify()
+    return jsonify(indexer.status())
+
+@app.route('/index-status')
+def index_status():
+    # Index freshness, queue depth and progress of the background indexer
+    return jsonify(start_indexer().status())
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -3,13 +3,13 @@ import os
 import uuid
 import shutil
 from werkzeug.utils import secure_filename
+from doc_collections import DEFAULT_COLLECTION, collection_paths, list_collections
 
 app = Flask(__name__)
 app.secret_key = "upload_secret_key"  # For flash messages
 
-# Configure upload folder
-UPLOAD_FOLDER = 'documents'
-VECTOR_STORE = 'vector_store'
+# Configure upload folder (of the default collection)
+UPLOAD_FOLDER, VECTOR_STORE, _ = collection_paths(DEFAULT_COLLECTION)
 ALLOWED_EXTENSIONS = {'pdf'}
 
 # Create the upload directory if it doesn't exist
@@ -18,6 +18,17 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def current_collection():
+    """Collection selected by the request, with its upload folder and vector store path"""
+    collection = (request.values.get('new_collection') or request.values.get('collection') or DEFAULT_COLLECTION).strip()
+    try:
+        upload_folder, vector_store, _ = collection_paths(collection)
+    except ValueError:
+        flash(f'Invalid collection name: {collection}', 'error')
+        collection = DEFAULT_COLLECTION
+        upload_folder, vector_store, _ = collection_paths(collection)
+    return collection, upload_folder, vector_store
+
 # HTML template for the upload interface
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -99,6 +110,20 @@ HTML_TEMPLATE = """
             -webkit-mask: url("data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 24 24' fill='none' stroke='currentColor' stroke-width='2' stroke-linecap='round' stroke-linejoin='round'%3E%3Cpath d='M21 15a2 2 0 0 1-2 2H7l-4 4V5a2 2 0 0 1 2-2h14a2 2 0 0 1 2 2z'%3E%3C/path%3E%3C/svg%3E") no-repeat center center;
         }
 
+        .collection-picker {
+            display: flex;
+            gap: 8px;
+            justify-content: center;
+            margin-bottom: 24px;
+        }
+        
+        .collection-picker input, .collection-picker select {
+            padding: 8px 12px;
+            border: 1px solid var(--border-color);
+            border-radius: 8px;
+            font-size: 0.9rem;
+        }
+        
         .nav-links {
             display: flex;
             position: absolute;
@@ -503,7 +528,17 @@ HTML_TEMPLATE = """
             <h1>Upload Documents</h1>
             <p>Upload PDF files for analysis by our AI assistant.</p>
             
+            <form action="/" method="get" class="collection-picker">
+                <select name="collection" onchange="this.form.submit()">
+                    {% for name in collections %}
+                        <option value="{{ name }}" {% if name == collection %}selected{% endif %}>{{ name }}</option>
+                    {% endfor %}
+                </select>
+                <input type="text" name="new_collection" placeholder="New collection" pattern="[A-Za-z0-9][A-Za-z0-9_-]{0,63}" onchange="this.form.submit()">
+            </form>
+            
             <form action="/upload" method="post" enctype="multipart/form-data" id="upload-form">
+                <input type="hidden" name="collection" value="{{ collection }}">
                 <div class="upload-area" id="upload-area">
                     <div class="upload-icon">
                         <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
@@ -514,7 +549,7 @@ HTML_TEMPLATE = """
                     </div>
                     <div class="upload-text">Drag & drop your file here</div>
                     <div class="upload-hint">or click to browse your files</div>
-                    <input type="file" name="file" class="file-input" id="file-input" accept=".pdf">
+                    <input type="file" name="file" class="file-input" id="file-input" accept=".pdf" multiple>
                 </div>
                 
                 <div class="selected-file" id="selected-file">
@@ -573,6 +608,7 @@ HTML_TEMPLATE = """
                 <button type="button" class="modal-btn cancel-btn" onclick="closeDeleteModal()">Cancel</button>
                 <form action="/delete" method="post" id="delete-form">
                     <input type="hidden" name="filename" id="delete-filename-input">
+                    <input type="hidden" name="collection" value="{{ collection }}">
                     <button type="submit" class="modal-btn confirm-btn">Delete</button>
                 </form>
             </div>
@@ -587,6 +623,7 @@ HTML_TEMPLATE = """
             <div class="modal-actions">
                 <button type="button" class="modal-btn cancel-btn" onclick="closeResetModal()">Cancel</button>
                 <form action="/reset-vector-store" method="post">
+                    <input type="hidden" name="collection" value="{{ collection }}">
                     <button type="submit" class="modal-btn confirm-btn">Reset</button>
                 </form>
             </div>
@@ -622,10 +659,10 @@ HTML_TEMPLATE = """
         // Handle file selection
         fileInput.addEventListener('change', function() {
             if (this.files.length > 0) {
-                const file = this.files[0];
+                const files = Array.from(this.files);
                 
-                if (isValidPdf(file)) {
-                    fileName.textContent = file.name;
+                if (files.every(isValidPdf)) {
+                    fileName.textContent = describeFiles(files);
                     selectedFile.style.display = 'block';
                     uploadBtn.disabled = false;
                     uploadArea.style.borderColor = 'var(--primary-color)';
@@ -657,11 +694,11 @@ HTML_TEMPLATE = """
             e.preventDefault();
             
             if (e.dataTransfer.files.length > 0) {
-                const file = e.dataTransfer.files[0];
+                const files = Array.from(e.dataTransfer.files);
                 
-                if (isValidPdf(file)) {
+                if (files.every(isValidPdf)) {
                     fileInput.files = e.dataTransfer.files;
-                    fileName.textContent = file.name;
+                    fileName.textContent = describeFiles(files);
                     selectedFile.style.display = 'block';
                     uploadBtn.disabled = false;
                 } else {
@@ -726,6 +763,10 @@ HTML_TEMPLATE = """
             uploadArea.style.backgroundColor = '';
         }
         
+        function describeFiles(files) {
+            return files.length === 1 ? files[0].name : `${files.length} files selected`;
+        }
+        
         function isValidPdf(file) {
             return file.type === 'application/pdf';
         }
@@ -763,12 +804,14 @@ HTML_TEMPLATE = """
 
 @app.route('/')
 def home():
+    collection, upload_folder, _ = current_collection()
+    
     # Get list of uploaded files
     files = []
-    if os.path.exists(UPLOAD_FOLDER):
-        for filename in os.listdir(UPLOAD_FOLDER):
+    if os.path.exists(upload_folder):
+        for filename in os.listdir(upload_folder):
             if filename.lower().endswith('.pdf'):
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
+                file_path = os.path.join(upload_folder, filename)
                 file_stats = os.stat(file_path)
                 # Basic file date - could be enhanced to show actual upload date if stored
                 import datetime
@@ -781,48 +824,64 @@ def home():
     # Sort files by date (newest first)
     files.sort(key=lambda x: x['name'], reverse=True)
     
-    return render_template_string(HTML_TEMPLATE, files=files)
+    collections = list_collections()
+    if collection not in collections:
+        collections.append(collection)
+    return render_template_string(HTML_TEMPLATE, files=files, collection=collection, collections=collections)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    collection, upload_folder, _ = current_collection()
+    
     # Check if the post request has the file part
     if 'file' not in request.files:
         flash('No file part', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('home', collection=collection))
     
-    file = request.files['file']
+    files = request.files.getlist('file')
     
     # If user does not select file, browser also
     # submit an empty part without filename
-    if file.filename == '':
+    if not files or all(file.filename == '' for file in files):
         flash('No selected file', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('home', collection=collection))
     
-    if file and allowed_file(file.filename):
-        # Create a secure filename and save
-        filename = secure_filename(file.filename)
-        
-        # If file exists, append a unique identifier
-        if os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{str(uuid.uuid4())[:8]}{ext}"
-        
-        file.save(os.path.join(UPLOAD_FOLDER, filename))
-        flash(f'File {filename} uploaded successfully!', 'success')
-        return redirect(url_for('home'))
+    os.makedirs(upload_folder, exist_ok=True)
+    uploaded = []
+    rejected = []
+    for file in files:
+        if file and allowed_file(file.filename):
+            # Create a secure filename and save
+            filename = secure_filename(file.filename)
+            
+            # If file exists, append a unique identifier
+            if os.path.exists(os.path.join(upload_folder, filename)):
+                name, ext = os.path.splitext(filename)
+                filename = f"{name}_{str(uuid.uuid4())[:8]}{ext}"
+            
+            file.save(os.path.join(upload_folder, filename))
+            uploaded.append(filename)
+        else:
+            rejected.append(file.filename)
     
-    flash('Invalid file type. Only PDF files are allowed.', 'error')
-    return redirect(url_for('home'))
+    if len(uploaded) == 1:
+        flash(f'File {uploaded[0]} uploaded successfully!', 'success')
+    elif uploaded:
+        flash(f'{len(uploaded)} files uploaded successfully!', 'success')
+    if rejected:
+        flash(f'Invalid file type for {", ".join(rejected)}. Only PDF files are allowed.', 'error')
+    return redirect(url_for('home', collection=collection))
 
 @app.route('/delete', methods=['POST'])
 def delete_file():
+    collection, upload_folder, _ = current_collection()
     filename = request.form.get('filename')
     
     if not filename:
         flash('No file specified', 'error')
-        return redirect(url_for('home'))
+        return redirect(url_for('home', collection=collection))
     
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    file_path = os.path.join(upload_folder, secure_filename(filename))
     
     # Check if file exists
     if os.path.exists(file_path):
@@ -834,22 +893,24 @@ def delete_file():
     else:
         flash('File not found', 'error')
     
-    return redirect(url_for('home'))
+    return redirect(url_for('home', collection=collection))
 
 @app.route('/reset-vector-store', methods=['POST'])
 def reset_vector_store():
+    collection, _, vector_store = current_collection()
+    
     # Check if vector store directory exists
-    if os.path.exists(VECTOR_STORE):
+    if os.path.exists(vector_store):
         try:
             # Delete the entire directory
-            shutil.rmtree(VECTOR_STORE)
+            shutil.rmtree(vector_store)
             flash('Vector store has been reset successfully!', 'success')
         except Exception as e:
             flash(f'Error resetting vector store: {str(e)}', 'error')
     else:
         flash('Vector store does not exist or has already been reset', 'success')
     
-    return redirect(url_for('home'))
+    return redirect(url_for('home', collection=collection))
 
 # Add route to access chat application
 @app.route('/chat')
@@ -0,0 +1,180 @@
+"""
+Quality and latency comparison of the quantized load modes for the local chat models.
+
+Every mode is loaded in its own subprocess, so peak memory is measured per
+mode and only one copy of the model is in RAM at a time. For each mode it
+reports:
+
+- load time, weight size and peak RSS (loading passes through the unquantized
+  weights, so weight size is the steady-state footprint to compare)
+- prefill latency and decode tokens/s (greedy, through the GenerationScheduler)
+- perplexity on a reference text
+- agreement of the greedy outputs with the unquantized model (share of
+  tokens generated before the first divergence, and exact matches)
+
+Usage:
+    python bench_quantization.py --model Qwen/Qwen3-0.6B --modes none int8 int4
+    python bench_quantization.py --finetuned ./qwen3-1.7b-finetuned-final --output quant.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+
+DEFAULT_PROMPTS = [
+    "Explain the difference between a contract and a memorandum of understanding.",
+    "Summarize the main causes of inflation in three sentences.",
+    "Write a short email asking a colleague to review a pull request.",
+    "What should I check before signing a residential lease?",
+]
+
+REFERENCE_TEXT = (
+    "The court held that the agreement was enforceable because both parties had exchanged "
+    "consideration and intended to be bound. A contract requires an offer, an acceptance of that "
+    "offer, and consideration flowing between the parties. Where one party relies on a promise to "
+    "its detriment, equity may prevent the other from going back on it even without consideration. "
+    "Damages for breach aim to put the injured party in the position it would have been in had the "
+    "contract been performed, but losses that were not reasonably foreseeable are not recoverable."
+)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB"""
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def load(args, mode):
+    """Load the model under test in one mode; returns (model, tokenizer, device)"""
+    if args.finetuned:
+        from finetuned_model import load_model
+        return load_model(args.finetuned, mode)
+    from model_server import get_model
+    return get_model(args.model, mode)
+
+
+def perplexity(model, tokenizer, device, text):
+    import torch
+    input_ids = torch.tensor([tokenizer(text)["input_ids"]], device=device)
+    with torch.inference_mode():
+        loss = model(input_ids=input_ids, labels=input_ids).loss
+    return float(torch.exp(loss.float()))
+
+
+def format_prompt(tokenizer, prompt):
+    if getattr(tokenizer, "chat_template", None):
+        messages = [{"role": "user", "content": prompt}]
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return f"{prompt}\n\nAnswer:"
+
+
+def run_mode(args, mode):
+    """Measure one load mode in this process"""
+    from generation import GenerationScheduler
+
+    start = time.time()
+    model, tokenizer, device = load(args, mode)
+    load_seconds = time.time() - start
+    from quantization import model_size_mb
+    results = {
+        "mode": mode,
+        "load_seconds": load_seconds,
+        "weights_mb": model_size_mb(model),
+        "perplexity": perplexity(model, tokenizer, device, args.reference_text or REFERENCE_TEXT),
+    }
+
+    # No caches and no stop tokens: every prompt pays a full prefill and decodes exactly max_new_tokens
+    scheduler = GenerationScheduler(model, tokenizer, device, max_batch_size=1, session_cache_budget=0, prefix_cache_budget=0)
+    scheduler.generate(tokenizer(format_prompt(tokenizer, "Hello"))["input_ids"], max_new_tokens=2, temperature=0, eos_token_ids=[])
+
+    prefill_ms, decode_rates, outputs = [], [], []
+    for prompt in args.prompts:
+        input_ids = tokenizer(format_prompt(tokenizer, prompt))["input_ids"]
+        request = scheduler.submit(input_ids, max_new_tokens=args.max_new_tokens, temperature=0, eos_token_ids=[])
+        tokens = request.result()
+        finished = time.time()
+        prefill_ms.append((request.first_token_time - request.submitted) * 1000)
+        if len(tokens) > 1:
+            decode_rates.append((len(tokens) - 1) / (finished - request.first_token_time))
+        outputs.append(tokens)
+
+    results.update({
+        "prefill_ms": sum(prefill_ms) / len(prefill_ms),
+        "decode_tokens_per_second": sum(decode_rates) / len(decode_rates) if decode_rates else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "outputs": outputs,
+        "sample": tokenizer.decode(outputs[0], skip_special_tokens=True),
+    })
+    return results
+
+
+def agreement(outputs, baseline):
+    """Share of tokens matching the baseline up to the first divergence, and share of identical outputs"""
+    matched, total, exact = 0, 0, 0
+    for tokens, reference in zip(outputs, baseline):
+        prefix = 0
+        while prefix < min(len(tokens), len(reference)) and tokens[prefix] == reference[prefix]:
+            prefix += 1
+        matched += prefix
+        total += len(reference)
+        exact += tokens == reference
+    return {
+        "token_agreement": matched / total if total else 0.0,
+        "exact_match": exact / len(baseline) if baseline else 0.0,
+    }
+
+
+def run_subprocess(args, mode):
+    """Run one mode in a fresh interpreter and read its results"""
+    command = [sys.executable, __file__, "--worker", mode, "--max-new-tokens", str(args.max_new_tokens)]
+    command += ["--finetuned", args.finetuned] if args.finetuned else ["--model", args.model]
+    if args.reference_text:
+        command += ["--reference-text", args.reference_text]
+    command += ["--prompts", *args.prompts]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        return {"mode": mode, "error": f"exited with status {completed.returncode}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="meta-llama/Llama-3.2-3B-Instruct", help="Hugging Face model (loaded like lightweight.chat)")
+    parser.add_argument("--finetuned", default=None, help="Fine-tuned model path (loaded like finetuned_model.chat); overrides --model")
+    parser.add_argument("--modes", nargs="+", default=["none", "int8", "int4"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--prompts", nargs="+", default=DEFAULT_PROMPTS)
+    parser.add_argument("--reference-text", default=None, help="Text to compute perplexity on")
+    parser.add_argument("--output", default="quantization_results.json", help="Where to write the JSON results")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        # Child process: measure one mode and hand the results back on stdout
+        print(json.dumps(run_mode(args, args.worker)))
+        return 0
+
+    results = {mode: run_subprocess(args, mode) for mode in args.modes}
+    baseline = results.get("none", {}).get("outputs")
+    for mode, result in results.items():
+        if baseline and "outputs" in result:
+            result.update(agreement(result["outputs"], baseline))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{'mode':<6} {'weights MB':>10} {'peak RSS MB':>11} {'prefill ms':>10} {'tok/s':>7} {'ppl':>7} {'agree':>6}")
+    for mode, result in results.items():
+        if "error" in result:
+            print(f"{mode:<6} {result['error']}")
+            continue
+        rate = result["decode_tokens_per_second"] or 0.0
+        print(f"{mode:<6} {result['weights_mb']:>10.0f} {result['peak_rss_mb']:>11.0f} {result['prefill_ms']:>10.0f} "
+              f"{rate:>7.1f} {result['perplexity']:>7.2f} {result.get('token_agreement', 1.0):>6.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
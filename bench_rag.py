@@ -0,0 +1,519 @@
+"""
+Benchmark and regression harness for the RAG subsystem.
+
+Generates a synthetic corpus with a configurable size and file-type mix, indexes
+it with a fresh RAGEngine and reports:
+
+- ingest throughput (docs/s, chunks/s) and time per ingest stage
+- peak RSS of the process and of its extraction workers
+- on-disk index size
+- query latency p50/p95/p99
+- recall@k against a labeled query set (one planted fact per document)
+- with --rerank, the same queries again through the cross-encoder stage, with
+  recall and latency compared to the non-reranked baseline
+- with --evaluate-index, recall@10 and latency of the vector index against
+  exact search over the same vectors
+
+Results are written as JSON; pass --compare with an earlier result file to print
+the change of every metric. Runs fully offline: either a small local
+sentence-transformers model (--model, loaded with HF_HUB_OFFLINE=1) or, by
+default when no model is given, deterministic hashing embeddings.
+
+Usage:
+    python bench_rag.py --docs 500 --mix txt=0.4,pdf=0.3,docx=0.1,csv=0.1,xlsx=0.1 --output bench.json
+    python bench_rag.py --docs 500 --model ./models/all-MiniLM-L6-v2 --compare bench.json
+    python bench_rag.py --docs 500 --model ./models/all-MiniLM-L6-v2 --rerank ./models/ms-marco-MiniLM-L-6-v2
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import zipfile
+import argparse
+import resource
+import tempfile
+import platform
+from xml.sax.saxutils import escape
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MIX = "txt=0.4,pdf=0.3,docx=0.1,csv=0.1,xlsx=0.1"
+FILLER_WORDS = 2000
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings by feature hashing.
+
+    Needs no model download; similarity is driven by shared tokens, which is
+    enough to exercise indexing and retrieval end to end.
+    """
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+# Synthetic corpus
+
+def parse_mix(mix):
+    """Parse "txt=0.5,pdf=0.5" into normalized {extension: share}"""
+    shares = {}
+    for part in mix.split(","):
+        extension, _, share = part.partition("=")
+        shares[extension.strip().lstrip(".")] = float(share or 1)
+    total = sum(shares.values())
+    return {extension: share / total for extension, share in shares.items()}
+
+
+def random_sentence(rng, vocabulary, length=None):
+    words = rng.choices(vocabulary, k=length or rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def make_fact(rng, doc_id):
+    """A planted fact that only this document contains, and the query that asks for it"""
+    code = f"{rng.choice('BCDFGHKMNPRSTVZ')}{rng.randint(1000, 9999)}"
+    party = f"{rng.choice(['Alder', 'Birch', 'Cedar', 'Elm', 'Hazel', 'Maple', 'Rowan', 'Willow'])}{doc_id}"
+    fact = f"The settlement reference for the {party} matter is {code}."
+    query = f"What is the settlement reference for the {party} matter?"
+    return fact, query
+
+
+def make_paragraphs(rng, vocabulary, fact, words):
+    """Filler paragraphs of about `words` words with the fact in a random paragraph"""
+    paragraphs = []
+    count = 0
+    while count < words:
+        sentences = [random_sentence(rng, vocabulary) for _ in range(rng.randint(3, 7))]
+        count += sum(len(sentence.split()) for sentence in sentences)
+        paragraphs.append(" ".join(sentences))
+    position = rng.randrange(len(paragraphs))
+    paragraphs[position] = f"{paragraphs[position]} {fact}"
+    return paragraphs
+
+
+def write_txt(path, paragraphs):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def write_pdf(path, paragraphs, lines_per_page=45, line_width=90):
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)"""
+    lines = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        line = ""
+        for word in words:
+            if len(line) + len(word) + 1 > line_width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = []
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    for page_lines in pages:
+        text = "".join(
+            f"({line.replace(chr(92), chr(92) * 2).replace('(', chr(92) + '(').replace(')', chr(92) + ')')}) Tj T* "
+            for line in page_lines
+        )
+        stream = f"BT /F1 10 Tf 14 TL 50 770 Td {text}ET".encode("latin-1", "replace")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects.append((content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+        objects.append((page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("latin-1")))
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects = [
+        (1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+        (2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")),
+        (font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"),
+    ] + objects
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id, body in objects:
+            offsets[object_id] = f.tell()
+            f.write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (next_id))
+        for object_id in range(1, next_id):
+            f.write(b"%010d 00000 n \n" % offsets[object_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_id, xref))
+
+
+def write_docx(path, paragraphs):
+    """Write a minimal DOCX (one w:p per paragraph) readable by docx2txt"""
+    body = "".join(f"<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>" for paragraph in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="word/document.xml"/></Relationships>'
+        ))
+        docx.writestr("word/document.xml", document)
+
+
+def table_rows(rng, vocabulary, fact, rows):
+    """Rows of a synthetic ledger with the fact in the notes column of one row"""
+    header = ["id", "date", "party", "amount", "notes"]
+    data = []
+    fact_row = rng.randrange(rows)
+    for i in range(rows):
+        notes = fact if i == fact_row else random_sentence(rng, vocabulary, 6)
+        data.append([str(i + 1), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                     rng.choice(vocabulary).capitalize(), f"{rng.uniform(10, 10000):.2f}", notes])
+    return header, data
+
+
+def write_csv(path, header, data):
+    import csv
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(data)
+
+
+def write_xlsx(path, header, data):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Ledger")
+    sheet.append(header)
+    for row in data:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def generate_corpus(directory, docs, mix, words=FILLER_WORDS, rows=200, seed=0):
+    """
+    Write a synthetic corpus and its labeled queries
+
+    Returns:
+        list: {"query", "source"} dicts, one per document
+    """
+    rng = random.Random(seed)
+    vocabulary = sorted({"".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9))) for _ in range(5000)})
+    extensions = list(mix)
+    weights = [mix[extension] for extension in extensions]
+    os.makedirs(directory, exist_ok=True)
+
+    labels = []
+    for doc_id in range(docs):
+        extension = rng.choices(extensions, weights)[0]
+        filename = f"doc_{doc_id:06d}.{extension}"
+        path = os.path.join(directory, filename)
+        fact, query = make_fact(rng, doc_id)
+        if extension in ("csv", "xlsx"):
+            header, data = table_rows(rng, vocabulary, fact, rows)
+            (write_csv if extension == "csv" else write_xlsx)(path, header, data)
+        else:
+            paragraphs = make_paragraphs(rng, vocabulary, fact, words)
+            {"txt": write_txt, "pdf": write_pdf, "docx": write_docx}[extension](path, paragraphs)
+        labels.append({"query": query, "source": filename})
+    return labels
+
+
+# Measurements
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (finished) child processes, in MB"""
+    scale = 1 if platform.system() == "Darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6
+    return {"self": own, "children": children}
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+class StageTimer:
+    """Progress callback that records the wall time spent in each ingest stage"""
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        self.started = None
+
+    def __call__(self, stage, done, total):
+        now = time.perf_counter()
+        if stage != self.current:
+            self.finish(now)
+            self.current, self.started = stage, now
+
+    def finish(self, now=None):
+        if self.current is not None:
+            now = now or time.perf_counter()
+            self.stages[self.current] = self.stages.get(self.current, 0.0) + now - self.started
+            self.current = None
+
+
+def load_embeddings(model, workdir, batch_size):
+    if not model:
+        return HashingEmbeddings(), "hashing"
+    # Never reach out to the hub; the model has to be on disk already
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    from embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(model, cache_dir=os.path.join(workdir, "embedding_cache"), batch_size=batch_size), model
+
+
+def run_queries(rag_system, queries, cutoffs, rerank=False):
+    """
+    Run every labeled query once (cold caches)
+
+    Returns:
+        dict: latency_ms percentiles and recall at each cutoff, by source file
+    """
+    latencies = []
+    hits = {k: 0 for k in cutoffs}
+    max_k = max(cutoffs)
+    for label in queries:
+        start = time.perf_counter()
+        docs = rag_system.retrieve(label["query"], k=max_k, rerank=rerank) if rag_system is not None else []
+        latencies.append((time.perf_counter() - start) * 1000)
+        sources = [doc.metadata.get("source") for doc in docs]
+        for k in cutoffs:
+            if label["source"] in sources[:k]:
+                hits[k] += 1
+    return {
+        "count": len(queries),
+        "latency_ms": percentiles(latencies),
+        "recall": {f"@{k}": hits[k] / len(queries) if queries else None for k in cutoffs},
+    }
+
+
+def run_benchmark(args):
+    from rag import RAGEngine
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_rag_")
+    directory = os.path.join(workdir, "documents")
+    if os.path.exists(directory) and not args.keep_corpus:
+        shutil.rmtree(directory)
+    for stale in ("vector_store", "file_registry.db"):
+        stale_path = os.path.join(workdir, stale)
+        if os.path.isdir(stale_path):
+            shutil.rmtree(stale_path)
+        elif os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    mix = parse_mix(args.mix)
+    labels_path = os.path.join(workdir, "labels.json")
+    start = time.perf_counter()
+    if args.keep_corpus and os.path.exists(labels_path):
+        with open(labels_path, 'r') as f:
+            labels = json.load(f)
+    else:
+        labels = generate_corpus(directory, args.docs, mix, words=args.words, rows=args.rows, seed=args.seed)
+        with open(labels_path, 'w') as f:
+            json.dump(labels, f)
+    generate_s = time.perf_counter() - start
+
+    embeddings, embedding_name = load_embeddings(args.model, workdir, args.batch_size)
+    engine = RAGEngine(
+        directory_path=directory,
+        vector_store_path=os.path.join(workdir, "vector_store"),
+        file_registry_path=os.path.join(workdir, "file_registry.db"),
+        workers=args.workers,
+        index_type=args.index_type,
+        hybrid=not args.dense_only,
+        initial_refresh=False,
+        embeddings=embeddings
+    )
+
+    # Cold ingest, timed per stage through the progress callback
+    timer = StageTimer()
+    start = time.perf_counter()
+    engine.refresh(progress=timer)
+    timer.finish()
+    ingest_s = time.perf_counter() - start
+    rag_system = engine.rag_system
+    chunks = rag_system.vector_store.index.ntotal if rag_system is not None else 0
+
+    # A refresh with nothing changed should cost a directory scan
+    start = time.perf_counter()
+    engine.refresh()
+    noop_refresh_s = time.perf_counter() - start
+
+    # Queries: every labeled query once (cold caches), recall@k by source file
+    queries = labels[:args.queries] if args.queries else labels
+    query_results = run_queries(rag_system, queries, args.k)
+
+    rerank_results = None
+    if args.rerank and rag_system is not None:
+        # Same queries through the cross-encoder over rerank_candidates dense/hybrid hits
+        from rerank import Reranker
+        rag_system.reranker = Reranker(args.rerank)
+        rag_system.rerank_candidates = max(args.rerank_candidates, max(args.k))
+        rerank_results = run_queries(rag_system, queries, args.k, rerank=True)
+        rerank_results["model"] = args.rerank
+        rerank_results["candidates"] = rag_system.rerank_candidates
+        rerank_results["recall_change"] = {
+            cutoff: recall - query_results["recall"][cutoff]
+            for cutoff, recall in rerank_results["recall"].items() if recall is not None
+        }
+        rerank_results["latency_change_ms"] = {
+            name: value - query_results["latency_ms"][name]
+            for name, value in rerank_results["latency_ms"].items()
+        }
+
+    results = {
+        "config": {
+            "docs": len(labels),
+            "mix": mix,
+            "words": args.words,
+            "rows": args.rows,
+            "seed": args.seed,
+            "embeddings": embedding_name,
+            "index_type": args.index_type,
+            "hybrid": not args.dense_only,
+            "rerank": args.rerank,
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "ingest": {
+            "generate_s": generate_s,
+            "ingest_s": ingest_s,
+            "docs_per_s": len(labels) / ingest_s if ingest_s else None,
+            "chunks": chunks,
+            "chunks_per_s": chunks / ingest_s if ingest_s else None,
+            "stages_s": timer.stages,
+            "noop_refresh_s": noop_refresh_s,
+        },
+        "index": {
+            "vector_store_bytes": directory_size(engine.vector_store_path),
+            "registry_bytes": os.path.getsize(engine.file_registry_path) if os.path.exists(engine.file_registry_path) else 0,
+        },
+        "query": query_results,
+        "memory_mb": peak_rss_mb(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    if rerank_results is not None:
+        results["rerank"] = rerank_results
+
+    if args.evaluate_index and rag_system is not None:
+        # Recall of the approximate index against exact search over the same vectors;
+        # run after memory_mb was taken, since it holds a second copy of the vectors
+        from vector_index import evaluate_index
+        results["index"]["evaluation"] = evaluate_index(rag_system.vector_store, embeddings=embeddings)
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline):
+    """Print the relative change of every numeric metric against a baseline result"""
+    current, previous = flatten(results), flatten(baseline)
+    print(f"\n{'metric':45} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(current):
+        if name.startswith("config.") or name not in previous:
+            continue
+        before, after = previous[name], current[name]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:45} {before:12.4g} {after:12.4g} {change:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200, help="Number of synthetic documents")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="File-type mix, e.g. txt=0.5,pdf=0.5")
+    parser.add_argument("--words", type=int, default=FILLER_WORDS, help="Words per prose document")
+    parser.add_argument("--rows", type=int, default=200, help="Rows per CSV/XLSX document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=None, help="Local sentence-transformers model path (hashing embeddings if omitted)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes")
+    parser.add_argument("--index-type", default="auto")
+    parser.add_argument("--dense-only", action="store_true", help="Disable BM25 hybrid retrieval")
+    parser.add_argument("--evaluate-index", action="store_true",
+                        help="Measure recall@10 of the vector index against exact search (needs a second copy of the vectors)")
+    parser.add_argument("--queries", type=int, default=0, help="Number of labeled queries to run (all by default)")
+    parser.add_argument("--rerank", default=None, help="Local cross-encoder model path; also measures reranked queries")
+    parser.add_argument("--rerank-candidates", type=int, default=20, help="Candidates retrieved for the reranker")
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 5, 10], help="Cutoffs for recall@k")
+    parser.add_argument("--workdir", default=None, help="Keep corpus and index here instead of a temp dir")
+    parser.add_argument("--keep-corpus", action="store_true", help="Reuse the corpus already in --workdir")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
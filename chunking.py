@@ -0,0 +1,225 @@
+import re
+
+# all-MiniLM-L6-v2 truncates its input at 256 word pieces; anything past that is never embedded
+DEFAULT_MAX_TOKENS = 256
+# Used to size chunks when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+ROW_PATTERN = re.compile(r"^Row \d+:")
+NUMBERED_HEADING_PATTERN = re.compile(r"^(\d+(\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+[A-Z]")
+KEYWORD_HEADING_PATTERN = re.compile(r"^(chapter|section|article|part|appendix|schedule|exhibit)\s+[\dIVXLCA-Z]", re.IGNORECASE)
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+
+# Chunking strategy per file extension
+STRATEGIES = {
+    ".csv": "table",
+    ".xlsx": "table",
+    ".xls": "table",
+    ".pdf": "pdf",
+    ".docx": "paragraphs",
+    ".doc": "paragraphs",
+    ".txt": "paragraphs",
+}
+
+
+def is_heading(line):
+    """Heuristic for a section heading line in extracted PDF text"""
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith((".", ",", ";")):
+        return False
+    if NUMBERED_HEADING_PATTERN.match(line) or KEYWORD_HEADING_PATTERN.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and line.isupper()
+
+
+class Chunker:
+    """
+    Structure-aware chunking sized in embedding-model tokens.
+
+    Text is cut into structural units first (table rows, headings and
+    paragraphs, sentences) and the units are packed greedily into chunks of at
+    most max_tokens tokens of the embedding model, so chunks fill the model's
+    input window instead of being cut at a fixed character count. Each unit is
+    tokenized once, in a batch, and chunk sizes are sums of unit sizes.
+
+    Strategies:
+        table: row groups, each repeating the table's header lines
+        pdf: sections started at heading lines, then paragraphs (one page per document)
+        paragraphs: paragraphs, then sentences for oversized paragraphs
+    """
+    def __init__(self, tokenizer=None, max_tokens=DEFAULT_MAX_TOKENS, min_tokens=None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        # A heading only starts a new chunk once the current one is reasonably full
+        self.min_tokens = min_tokens if min_tokens is not None else max_tokens // 2
+
+    @classmethod
+    def from_embeddings(cls, embeddings, max_tokens=None):
+        """Chunker using the tokenizer and input length of a sentence-transformers backed embeddings object"""
+        model = getattr(embeddings, "model", None)
+        tokenizer = getattr(model, "tokenizer", None)
+        if max_tokens is None:
+            max_seq_length = getattr(model, "max_seq_length", None) or DEFAULT_MAX_TOKENS
+            # Leave room for the [CLS] and [SEP] tokens the model adds
+            max_tokens = max_seq_length - 2 if tokenizer is not None else max_seq_length
+        return cls(tokenizer=tokenizer, max_tokens=max_tokens)
+
+    def signature(self):
+        """Settings that decide chunk boundaries; stores chunked with another signature are re-chunked"""
+        sizing = "tokens" if self.tokenizer is not None else "chars"
+        return f"{sizing}-{self.max_tokens}-{self.min_tokens}"
+
+    def count(self, texts):
+        """Token counts of several texts, tokenized in one batch"""
+        if not texts:
+            return []
+        if self.tokenizer is None:
+            return [max(1, len(text) // CHARS_PER_TOKEN) for text in texts]
+        encoded = self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def split(self, text, file_extension=None):
+        """
+        Split a document's text into chunks with the strategy for its file type
+
+        Args:
+            text: Document text (a whole file, or a single PDF page)
+            file_extension: Lower-cased extension of the source file
+
+        Returns:
+            list: Chunk strings
+        """
+        strategy = STRATEGIES.get(file_extension, "paragraphs")
+        if strategy == "table":
+            chunks = self.split_table(text)
+            if chunks:
+                return chunks
+        if strategy == "pdf":
+            return self.split_pdf(text)
+        return self.split_paragraphs(text)
+
+    def split_table(self, text):
+        """
+        Group table rows into chunks, repeating the header lines of their table in each
+
+        Row lines look like "Row N: column: value, ..."; any other lines (file,
+        sheet and header lines) start a new table whose header they form.
+        Returns an empty list when the text has no rows.
+        """
+        tables = []
+        header, rows = [], []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if ROW_PATTERN.match(line):
+                rows.append(line)
+                continue
+            if rows:
+                tables.append((header, rows))
+                header, rows = [], []
+            header.append(line)
+        if rows:
+            tables.append((header, rows))
+
+        chunks = []
+        for header, rows in tables:
+            header_text = "\n".join(header)
+            header_tokens = self.count([header_text])[0] if header else 0
+            budget = max(self.max_tokens - header_tokens, self.max_tokens // 4)
+            for group in self.pack(rows, self.count(rows), budget, separator="\n"):
+                chunks.append(f"{header_text}\n{group}" if header else group)
+        return chunks
+
+    def split_pdf(self, text):
+        """Split a PDF page into sections at heading lines, then pack paragraphs within the budget"""
+        units, boundaries = [], []
+        for paragraph in PARAGRAPH_PATTERN.split(text):
+            # A heading opens a new unit that also holds the text under it
+            block, opens_section = [], False
+            for line in paragraph.splitlines():
+                if not line.strip():
+                    continue
+                if is_heading(line):
+                    if block:
+                        units.append("\n".join(block))
+                        boundaries.append(opens_section)
+                    block, opens_section = [line.strip()], True
+                else:
+                    block.append(line)
+            if block:
+                units.append("\n".join(block))
+                boundaries.append(opens_section)
+        return self.pack_units(units, boundaries)
+
+    def split_paragraphs(self, text):
+        units = [paragraph.strip() for paragraph in PARAGRAPH_PATTERN.split(text) if paragraph.strip()]
+        return self.pack_units(units, [False] * len(units))
+
+    def pack_units(self, units, boundaries):
+        """Pack paragraph-like units, breaking oversized ones into sentences and then token windows"""
+        pieces, piece_boundaries = [], []
+        counts = self.count(units)
+        for unit, tokens, boundary in zip(units, counts, boundaries):
+            if tokens <= self.max_tokens:
+                pieces.append(unit)
+                piece_boundaries.append(boundary)
+                continue
+            for i, piece in enumerate(self.split_oversized(unit)):
+                pieces.append(piece)
+                piece_boundaries.append(boundary and i == 0)
+        return self.pack(pieces, self.count(pieces), self.max_tokens, boundaries=piece_boundaries)
+
+    def split_oversized(self, text):
+        """Sentences of a unit that is too long for one chunk, with token windows for overlong sentences"""
+        pieces = []
+        sentences = [sentence for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+        for sentence, tokens in zip(sentences, self.count(sentences)):
+            if tokens <= self.max_tokens:
+                pieces.append(sentence)
+            else:
+                pieces.extend(self.token_windows(sentence))
+        return pieces
+
+    def token_windows(self, text):
+        """Cut text into consecutive windows of at most max_tokens tokens"""
+        if self.tokenizer is None:
+            size = self.max_tokens * CHARS_PER_TOKEN
+            return [text[i:i + size] for i in range(0, len(text), size)]
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        windows = []
+        for i in range(0, len(offsets), self.max_tokens):
+            window = offsets[i:i + self.max_tokens]
+            end = offsets[i + self.max_tokens][0] if i + self.max_tokens < len(offsets) else len(text)
+            windows.append(text[window[0][0]:end].strip())
+        return [window for window in windows if window]
+
+    def pack(self, units, counts, budget, separator="\n\n", boundaries=None):
+        """
+        Greedily pack units into chunks of at most budget tokens
+
+        Args:
+            units: Unit strings in document order
+            counts: Token count of each unit
+            budget: Maximum tokens per chunk
+            separator: Text placed between units of a chunk
+            boundaries: Optional flags of units that should start a new chunk
+                        (headings) once the current chunk holds min_tokens
+
+        Returns:
+            list: Chunk strings
+        """
+        chunks = []
+        current = []
+        size = 0
+        for i, (unit, tokens) in enumerate(zip(units, counts)):
+            boundary = boundaries[i] if boundaries is not None else False
+            if current and (size + tokens > budget or (boundary and size >= self.min_tokens)):
+                chunks.append(separator.join(current))
+                current, size = [], 0
+            current.append(unit)
+            size += tokens
+        if current:
+            chunks.append(separator.join(current))
+        return chunks
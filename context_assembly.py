@@ -0,0 +1,129 @@
+import re
+from langchain_community.docstore.document import Document
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def find_overlap(first, second, max_overlap=400, min_overlap=20):
+    """Length of the longest suffix of first that is also a prefix of second (0 if shorter than min_overlap)"""
+    for length in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent_chunks(docs):
+    """
+    Merge chunks of the same source and page (or row group) that are adjacent in the original text
+
+    The splitter's chunk overlap is removed where the end of one chunk repeats
+    at the start of the next. Each merged passage keeps the best (lowest)
+    retrieval rank of its members.
+
+    Args:
+        docs: Retrieved documents, best first
+
+    Returns:
+        list: (rank, Document) pairs, best first
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("segment"))
+        groups.setdefault(key, []).append((doc.metadata.get("chunk"), rank, doc))
+
+    passages = []
+    for members in groups.values():
+        members.sort(key=lambda member: (member[0] is None, member[0] or 0))
+        current = None
+        for chunk, rank, doc in members:
+            if current is not None and chunk is not None and current["last_chunk"] is not None and chunk == current["last_chunk"] + 1:
+                overlap = find_overlap(current["text"], doc.page_content)
+                current["text"] += doc.page_content[overlap:] if overlap else "\n" + doc.page_content
+                current["last_chunk"] = chunk
+                current["rank"] = min(current["rank"], rank)
+                continue
+            if current is not None:
+                passages.append(current)
+            current = {"text": doc.page_content, "metadata": dict(doc.metadata), "last_chunk": chunk, "rank": rank}
+        passages.append(current)
+
+    passages.sort(key=lambda passage: passage["rank"])
+    return [(passage["rank"], Document(page_content=passage["text"], metadata=passage["metadata"])) for passage in passages]
+
+
+def shingles(text, size=5):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def remove_near_duplicates(passages, threshold=0.8):
+    """Drop passages whose word shingles mostly repeat a better-ranked passage"""
+    kept = []
+    kept_shingles = []
+    for rank, doc in passages:
+        current = shingles(doc.page_content)
+        duplicate = False
+        for other in kept_shingles:
+            overlap = len(current & other) / max(1, min(len(current), len(other)))
+            if overlap >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append((rank, doc))
+            kept_shingles.append(current)
+    return kept
+
+
+def count_tokens(text, tokenizer=None):
+    """Token count with the target model's tokenizer, or a ~4 characters per token estimate"""
+    if tokenizer is None:
+        return max(1, len(text) // 4)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text, max_tokens, tokenizer=None):
+    if tokenizer is None:
+        return text[:max_tokens * 4]
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    return tokenizer.decode(ids[:max_tokens], skip_special_tokens=True)
+
+
+def assemble_context(docs, token_budget=None, tokenizer=None, separator="\n\n", min_tail_tokens=32):
+    """
+    Build a deduplicated context string from retrieved chunks within a token budget
+
+    Args:
+        docs: Retrieved documents, best first
+        token_budget: Maximum tokens of context, or None for no limit
+        tokenizer: Tokenizer of the model that will read the context
+        separator: Text placed between passages
+        min_tail_tokens: Smallest remaining budget worth filling with a truncated passage
+
+    Returns:
+        tuple: (context string, list of Documents that made it into the context)
+    """
+    passages = remove_near_duplicates(merge_adjacent_chunks(docs))
+
+    selected = []
+    used_tokens = 0
+    separator_tokens = count_tokens(separator, tokenizer) if token_budget is not None else 0
+    for _, doc in passages:
+        if token_budget is None:
+            selected.append(doc)
+            continue
+        cost = count_tokens(doc.page_content, tokenizer) + (separator_tokens if selected else 0)
+        if used_tokens + cost <= token_budget:
+            selected.append(doc)
+            used_tokens += cost
+            continue
+        # Fill what is left of the budget with the start of the next best passage
+        remaining = token_budget - used_tokens - (separator_tokens if selected else 0)
+        if remaining >= min_tail_tokens or not selected:
+            text = truncate_to_tokens(doc.page_content, max(remaining, 0), tokenizer)
+            if text:
+                selected.append(Document(page_content=text, metadata=doc.metadata))
+        break
+
+    return separator.join(doc.page_content for doc in selected), selected
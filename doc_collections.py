@@ -0,0 +1,33 @@
+import os
+import re
+
+DEFAULT_COLLECTION = "default"
+# Named collections live in collections/<name>/ with their own documents, index and registry
+COLLECTIONS_DIR = "collections"
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+def collection_paths(collection=None):
+    """
+    Document folder, vector store and registry paths of a collection
+
+    The default collection keeps the original top-level paths.
+
+    Returns:
+        tuple: (directory_path, vector_store_path, file_registry_path)
+    """
+    if collection in (None, "", DEFAULT_COLLECTION):
+        return "documents", "vector_store", "file_registry.db"
+    if not COLLECTION_NAME_PATTERN.match(collection):
+        raise ValueError(f"Invalid collection name: {collection!r}")
+    root = os.path.join(COLLECTIONS_DIR, collection)
+    return os.path.join(root, "documents"), os.path.join(root, "vector_store"), os.path.join(root, "file_registry.db")
+
+def list_collections():
+    """Names of the default collection and every named collection on disk"""
+    names = [DEFAULT_COLLECTION]
+    if os.path.isdir(COLLECTIONS_DIR):
+        names.extend(sorted(
+            name for name in os.listdir(COLLECTIONS_DIR)
+            if COLLECTION_NAME_PATTERN.match(name) and os.path.isdir(os.path.join(COLLECTIONS_DIR, name))
+        ))
+    return names
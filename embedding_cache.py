@@ -0,0 +1,200 @@
+import os
+import re
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by chunk hash, stored as a memory-mapped float32 array.
+
+    Vectors are appended to vectors.f32 and their keys to keys.txt in the same
+    row order, so the cache can be reopened by any process without unpickling.
+    Appends hold an exclusive flock on cache.lock and re-read both files under
+    it, so any number of processes (and instances) can share one cache.
+    """
+    def __init__(self, cache_dir, dim):
+        self.cache_dir = cache_dir
+        self.dim = dim
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.keys_path = os.path.join(cache_dir, "keys.txt")
+        self.lock_path = os.path.join(cache_dir, "cache.lock")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.keys_size = -1
+        with self.lock:
+            self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with every other process using this cache"""
+        with open(self.lock_path, 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Re-read keys and row count from disk if another writer appended since the last read"""
+        keys_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        if keys_size == self.keys_size:
+            return
+        keys = []
+        if keys_size:
+            with open(self.keys_path, 'r') as f:
+                keys = f.read().split()
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        # Keys are written after vectors, so a partial write leaves extra vector rows behind
+        count = min(len(keys), rows)
+        self.rows = {key: row for row, key in enumerate(keys[:count])}
+        self.count = count
+        self.orphan_keys = len(keys) > count
+        self.keys_size = keys_size
+        self._map()
+
+    def _map(self):
+        if self.count:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, keys, out):
+        """
+        Copy cached vectors into out
+
+        Args:
+            keys: Chunk hashes
+            out: float32 array of shape (len(keys), dim) to fill
+
+        Returns:
+            list: Positions in keys that were not found in the cache
+        """
+        missing = []
+        with self.lock:
+            # Pick up vectors other processes added
+            self._load()
+            for i, key in enumerate(keys):
+                row = self.rows.get(key)
+                if row is None:
+                    missing.append(i)
+                else:
+                    out[i] = self.vectors[row]
+        return missing
+
+    def add(self, keys, vectors):
+        """Append new vectors to the cache"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock, self._file_lock():
+            # Another writer may have appended since this instance last looked
+            self._load()
+            new = {}
+            for i, key in enumerate(keys):
+                if key not in self.rows:
+                    new.setdefault(key, i)
+            if not new:
+                return
+            with open(self.vectors_path, 'ab') as f:
+                # Under the lock nobody else is writing, so rows past the keyed ones
+                # can only be left over from an interrupted write
+                if f.tell() != self.count * 4 * self.dim:
+                    f.truncate(self.count * 4 * self.dim)
+                f.write(vectors[list(new.values())].tobytes())
+            lines = "".join(f"{key}\n" for key in new)
+            if self.orphan_keys:
+                # Likewise drop keys whose vectors never made it to disk. Readers open
+                # keys.txt without the file lock, so it is replaced whole, never rewritten in place
+                kept = "".join(f"{key}\n" for key in sorted(self.rows, key=self.rows.get))
+                tmp_path = f"{self.keys_path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(kept + lines)
+                os.replace(tmp_path, self.keys_path)
+                self.orphan_keys = False
+            else:
+                with open(self.keys_path, 'a') as f:
+                    f.write(lines)
+            for key in new:
+                self.rows[key] = self.count
+                self.count += 1
+            self.keys_size = os.path.getsize(self.keys_path)
+            self._map()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Batched sentence-transformers embeddings with a persistent on-disk cache.
+
+    Texts are hashed, looked up in an EmbeddingCache for this model, and only
+    the misses are encoded, sorted by length so each batch needs little padding.
+    Produces the same vectors as HuggingFaceEmbeddings for the same model.
+    """
+    def __init__(self, model_name, cache_dir="embedding_cache", batch_size=64, num_threads=None, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        model_slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.cache = EmbeddingCache(os.path.join(cache_dir, model_slug), self.dim)
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def encode(self, texts):
+        """Encode texts without the cache, in length-sorted batches to minimise padding"""
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        encoded = self.model.encode(
+            [texts[i] for i in order],
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(np.float32)
+        vectors = np.empty_like(encoded)
+        vectors[order] = encoded
+        return vectors
+
+    def embed_documents(self, texts):
+        """Embed chunks, reusing cached vectors and encoding only the misses"""
+        keys = [self.text_hash(text) for text in texts]
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing = self.cache.lookup(keys, vectors)
+
+        if missing:
+            # Encode each distinct missing text once
+            first = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            unique = list(first.values())
+            encoded = self.encode([texts[i] for i in unique])
+            self.cache.add([keys[i] for i in unique], encoded)
+            by_key = {keys[i]: row for i, row in zip(unique, encoded)}
+            for i in missing:
+                vectors[i] = by_key[keys[i]]
+
+        logger.info(f"Embedded {len(texts)} chunks ({len(texts) - len(missing)} cached, {len(missing)} encoded)")
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
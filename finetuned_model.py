@@ -4,23 +4,21 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftModel, PeftConfig
 import gc
 from rag import RAG
+from quantization import merge_adapters, quantize_model, DEFAULT_QUANTIZATION
+from generation import get_scheduler, decode_stream, shared_prefix_length
 # Global cache to avoid reloading the model
 model_cache = {}
 
-def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200, temperature=0.7, context=[],rag=False):
+def load_model(model_path="./qwen3-1.7b-finetuned-final", quantization=DEFAULT_QUANTIZATION):
     """
-    Generate responses using your fine-tuned Qwen model.
-    
+    Load the fine-tuned model once per process and load mode
+
     Args:
-        prompt (str): The user's query or prompt
         model_path (str): Path to your fine-tuned model
-        max_new_tokens (int): Maximum number of tokens to generate
-        temperature (float): Controls randomness (lower = more deterministic)
-        context (list): Previous conversation context in the format of 
-                        [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
-    
+        quantization (str): "none", "int8" or "int4" (see quantization.quantize_model)
+
     Returns:
-        str: The model's response
+        tuple: (model, tokenizer, device)
     """
     # Determine device (works on both Mac and Ubuntu)
     if torch.cuda.is_available():
@@ -31,33 +29,28 @@ def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200,
         device = "cpu"
     
     # Check if model is already loaded
-    if model_path not in model_cache:
+    key = (model_path, quantization)
+    if key not in model_cache:
         print(f"Loading fine-tuned model from {model_path} on {device}")
         
-        # Load the base model info
+        # Load the base model info (adapter_config.json marks a PEFT/LoRA checkpoint)
         try:
             config = PeftConfig.from_pretrained(model_path)
             base_model_name = config.base_model_name_or_path
+            is_adapter = True
             print(f"Detected base model: {base_model_name}")
         except:
             # If not a PEFT model, assume it's a full model
             base_model_name = "Qwen/Qwen3-1.7B"  # Default base model
+            is_adapter = False
             print(f"Using default base model: {base_model_name}")
         
         # Load tokenizer
         tokenizer = AutoTokenizer.from_pretrained(base_model_name)
         
-        # Load model - try both approaches
-        try:
-            # First try loading as a directly saved model
-            model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32,
-                device_map=device
-            )
-            print("Loaded fine-tuned model directly")
-        except:
-            # If that fails, load as a PEFT/LoRA model
+        if is_adapter:
+            # Load the adapter through PEFT rather than transformers' adapter integration,
+            # which injects LoRA layers that merge_and_unload cannot fold away
             print("Loading as PEFT model...")
             base_model = AutoModelForCausalLM.from_pretrained(
                 base_model_name,
@@ -66,18 +59,41 @@ def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200,
             )
             model = PeftModel.from_pretrained(base_model, model_path)
             print("Loaded model with LoRA weights")
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32,
+                device_map=device
+            )
+            print("Loaded fine-tuned model directly")
         
         # Set to evaluation mode
         model.eval()
         
+        # Fold the LoRA weights into the base weights, then quantize for CPU inference
+        model = merge_adapters(model)
+        model = quantize_model(model, quantization, device)
+        
         # Store in cache
-        model_cache[model_path] = (model, tokenizer)
-    else:
-        model, tokenizer = model_cache[model_path]
+        model_cache[key] = (model, tokenizer, device)
+    
+    return model_cache[key]
+
+
+def prepare_chat(prompt, model_path, context, rag, rag_token_budget, collection, rag_filter, quantization=None):
+    """
+    Load the model (once) and build the tokenized conversation for a chat turn
+
+    Returns:
+        tuple: (scheduler, tokenizer, chat_text, input_ids, prefix_length)
+    """
+    quantization = quantization or DEFAULT_QUANTIZATION
+    model, tokenizer, device = load_model(model_path, quantization)
     
     # Prepare conversation for Qwen format
     # Start with system message if not in context
-    if not any(msg.get("role") == "system" for msg in context):
+    default_system = not any(msg.get("role") == "system" for msg in context)
+    if default_system:
         messages = [{"role": "system", "content": "You are a helpful assistant. You are smart, analytical, and great at communicating."}]
     else:
         messages = []
@@ -86,7 +102,7 @@ def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200,
     messages.extend(context)
     #RAG
     if rag:
-        information=RAG(prompt=prompt)
+        information=RAG(prompt=prompt, token_budget=rag_token_budget, tokenizer=tokenizer, collection=collection, filter=rag_filter)
         messages.append({"role": "system", "content": f"""
                          Instructions:
                          - You will use the information below to inform you response to the user prompt.
@@ -103,29 +119,78 @@ def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200,
     chat_text = tokenizer.apply_chat_template(messages, tokenize=False)
     
     # Tokenize input
-    inputs = tokenizer(chat_text, return_tensors="pt").to(device)
-    
-    # Clear cache if needed
-    if device == "cuda":
-        torch.cuda.empty_cache()
-    elif device == "mps" and hasattr(torch.mps, 'empty_cache'):
-        torch.mps.empty_cache()
-    
-    # Generate with appropriate parameters
-    with torch.no_grad():
-        output = model.generate(
-            inputs.input_ids,
-            max_new_tokens=max_new_tokens,
-            temperature=temperature,
-            do_sample=True,
-            top_p=0.9,
-            top_k=40,
-            repetition_penalty=1.2,
-            pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
-        )
+    input_ids = tokenizer(chat_text)["input_ids"]
+    
+    # The default system message is the same for every chat; its key/values are shared across sessions.
+    # A caller-supplied first message is specific to one conversation and is left to the session cache
+    prefix_length = 0
+    if default_system:
+        prefix_length = shared_prefix_length(tokenizer, tokenizer.apply_chat_template(messages[:1], tokenize=False), input_ids)
+    
+    return get_scheduler((model_path, quantization), model, tokenizer, device), tokenizer, chat_text, input_ids, prefix_length
+
+
+def strip_stream(pieces):
+    """
+    Clean streamed text the way chat() cleans its full response
+
+    The leading "assistant" role marker is held back and dropped, and the
+    closing think tag is removed.
+    """
+    text = ""
+    sent = 0
+    for piece in pieces:
+        text += piece
+        body = text.lstrip()
+        # Still could be the start of the role marker
+        if "assistant".startswith(body.lower()):
+            continue
+        if body.lower().startswith("assistant"):
+            body = body[len("assistant"):].lstrip(": \n")
+        body = body.replace("</think>", "")
+        if len(body) > sent:
+            yield body[sent:]
+            sent = len(body)
+
+
+def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200, temperature=0.7, context=[],rag=False, rag_token_budget=1024, collection=None, rag_filter=None, session_id=None, quantization=None):
+    """
+    Generate responses using your fine-tuned Qwen model.
+    
+    Args:
+        prompt (str): The user's query or prompt
+        model_path (str): Path to your fine-tuned model
+        max_new_tokens (int): Maximum number of tokens to generate
+        temperature (float): Controls randomness (lower = more deterministic)
+        context (list): Previous conversation context in the format of 
+                        [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
+        rag (bool): Whether to add retrieved document context
+        rag_token_budget (int): Maximum number of model tokens spent on retrieved context
+        collection (str): Named document collection to retrieve from (default collection if None)
+        rag_filter (dict): Metadata filter applied before retrieval, e.g. {"source": "case.pdf"}
+        session_id (str): Conversation id; the key/values of its previous turn are reused,
+                          so only the new part of the conversation is prefilled
+        quantization (str): Load mode "none", "int8" or "int4"; defaults to MODEL_QUANTIZATION
+    
+    Returns:
+        str: The model's response
+    """
+    scheduler, tokenizer, chat_text, input_ids, prefix_length = prepare_chat(prompt, model_path, context, rag, rag_token_budget, collection, rag_filter, quantization)
+    
+    # Generate with appropriate parameters; concurrent callers share decoding steps
+    tokens = scheduler.generate(
+        input_ids,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=0.9,
+        top_k=40,
+        repetition_penalty=1.2,
+        session_id=session_id,
+        prefix_length=prefix_length,
+    )
     
     # Extract the model's response
-    full_output = tokenizer.decode(output[0], skip_special_tokens=True)
+    full_output = tokenizer.decode(input_ids + tokens, skip_special_tokens=True)
     
     # Extract just the assistant's response from the full output
     try:
@@ -152,4 +217,33 @@ def chat(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200,
     # Clean up any garbage collection
     gc.collect()
     
-    return response.replace("</think>","")
\ No newline at end of file
+    return response.replace("</think>","")
+
+
+def chat_stream(prompt, model_path="./qwen3-1.7b-finetuned-final", max_new_tokens=200, temperature=0.7, context=[], rag=False, rag_token_budget=1024, collection=None, rag_filter=None, session_id=None, quantization=None):
+    """
+    Stream a response from your fine-tuned Qwen model as it is generated.
+
+    Takes the same arguments as chat(). Retrieval and prefill happen before
+    the first piece is yielded; each following piece is yielded as soon as its
+    tokens are decoded. Closing the generator early (e.g. a client disconnect)
+    stops generation at the next token.
+
+    Yields:
+        str: Pieces of the response text
+    """
+    scheduler, tokenizer, chat_text, input_ids, prefix_length = prepare_chat(prompt, model_path, context, rag, rag_token_budget, collection, rag_filter, quantization)
+    request = scheduler.submit(
+        input_ids,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=0.9,
+        top_k=40,
+        repetition_penalty=1.2,
+        session_id=session_id,
+        prefix_length=prefix_length,
+    )
+    try:
+        yield from strip_stream(decode_stream(tokenizer, request.stream()))
+    finally:
+        request.cancel()
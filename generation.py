@@ -0,0 +1,456 @@
+import time
+import logging
+import queue
+import threading
+from collections import deque
+import torch
+from kv_cache import SessionKVCache, PrefixKVCache, SESSION_KV_BUDGET, PREFIX_KV_BUDGET, MIN_PREFIX_TOKENS, common_prefix_length
+
+try:
+    from transformers import DynamicCache
+except ImportError:
+    DynamicCache = None
+
+logger = logging.getLogger(__name__)
+
+# Most sequences decoded together in one forward pass
+MAX_BATCH_SIZE = 8
+
+
+def to_layers(past_key_values):
+    """Past key/values as a tuple of (key, value) tensors per layer, shaped [batch, heads, seq, head_dim]"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple(past_key_values)
+
+
+def to_cache(layers):
+    """Per-layer (key, value) tensors in the form the model expects as past_key_values"""
+    if DynamicCache is not None and hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(layers)
+    return layers
+
+
+def shared_prefix_length(tokenizer, prefix_text, input_ids):
+    """Number of leading prompt tokens that come from a fixed preamble text"""
+    return common_prefix_length(tokenizer(prefix_text)["input_ids"], input_ids)
+
+
+def left_pad(layers, mask, length):
+    """Left-pad per-layer key/values and their attention mask to a sequence length"""
+    pad = length - mask.shape[1]
+    if pad <= 0:
+        return layers, mask
+    padded = []
+    for key, value in layers:
+        shape = (key.shape[0], key.shape[1], pad, key.shape[3])
+        padded.append((
+            torch.cat([key.new_zeros(shape), key], dim=2),
+            torch.cat([value.new_zeros((shape[0], value.shape[1], pad, value.shape[3])), value], dim=2),
+        ))
+    return tuple(padded), torch.cat([mask.new_zeros((mask.shape[0], pad)), mask], dim=1)
+
+
+class GenerationRequest:
+    """One sequence being generated, with its own sampling parameters and stopping state"""
+    def __init__(self, input_ids, max_new_tokens=200, temperature=0.7, top_p=1.0, top_k=0,
+                 repetition_penalty=1.0, no_repeat_ngram_size=0, eos_token_ids=(), session_id=None, prefix_length=0):
+        self.input_ids = list(input_ids)
+        self.session_id = session_id
+        self.prefix_length = prefix_length
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.repetition_penalty = repetition_penalty
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.eos_token_ids = set(eos_token_ids)
+
+        self.tokens = []
+        self.seen = set(self.input_ids)
+        # (n-1)-gram -> tokens that followed it, for no_repeat_ngram_size
+        self.ngrams = {}
+        n = no_repeat_ngram_size
+        if n:
+            for i in range(len(self.input_ids) - n + 1):
+                self.ngrams.setdefault(tuple(self.input_ids[i:i + n - 1]), set()).add(self.input_ids[i + n - 1])
+
+        self.finished = threading.Event()
+        self.error = None
+        self.cancelled = False
+        # Generated tokens for stream(), ended by None
+        self.queue = queue.Queue()
+        self.submitted = time.time()
+        self.first_token_time = None
+
+    def tail(self, count):
+        """Last count tokens of prompt plus generated tokens"""
+        if count <= len(self.tokens):
+            return tuple(self.tokens[len(self.tokens) - count:])
+        missing = count - len(self.tokens)
+        return tuple(self.input_ids[max(len(self.input_ids) - missing, 0):] + self.tokens)
+
+    def banned_tokens(self):
+        """Tokens that would complete an n-gram already present in the sequence"""
+        n = self.no_repeat_ngram_size
+        if not n:
+            return ()
+        return self.ngrams.get(self.tail(n - 1), ())
+
+    def append(self, token):
+        """Record a generated token; returns True once the sequence should stop"""
+        n = self.no_repeat_ngram_size
+        if n and len(self.input_ids) + len(self.tokens) >= n - 1:
+            self.ngrams.setdefault(self.tail(n - 1), set()).add(token)
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+        self.tokens.append(token)
+        self.seen.add(token)
+        self.queue.put(token)
+        return token in self.eos_token_ids or len(self.tokens) >= self.max_new_tokens or self.cancelled
+
+    def sample(self, logits):
+        """Pick the next token from a [vocab] row of logits"""
+        logits = logits.float().clone()
+        if self.repetition_penalty != 1.0 and self.seen:
+            ids = torch.tensor(list(self.seen), device=logits.device)
+            scores = logits[ids]
+            logits[ids] = torch.where(scores < 0, scores * self.repetition_penalty, scores / self.repetition_penalty)
+        banned = self.banned_tokens()
+        if banned:
+            logits[list(banned)] = float("-inf")
+        if not self.temperature or self.temperature <= 0:
+            return int(torch.argmax(logits))
+
+        logits = logits / self.temperature
+        if self.top_k and self.top_k < logits.shape[-1]:
+            threshold = torch.topk(logits, self.top_k).values[-1]
+            logits[logits < threshold] = float("-inf")
+        if self.top_p < 1.0:
+            sorted_logits, sorted_ids = torch.sort(logits, descending=True)
+            cumulative = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+            # Drop tokens once the mass before them already reaches top_p; the best token always stays
+            remove = cumulative - torch.softmax(sorted_logits, dim=-1) >= self.top_p
+            logits[sorted_ids[remove]] = float("-inf")
+        return int(torch.multinomial(torch.softmax(logits, dim=-1), 1))
+
+    def close(self, error=None):
+        """Mark the sequence finished (or failed) and wake up its waiters"""
+        self.error = error
+        self.queue.put(None)
+        self.finished.set()
+
+    def cancel(self):
+        """Stop generating at the next token boundary, e.g. when a streaming client disconnects"""
+        self.cancelled = True
+
+    def stream(self):
+        """Yield generated token ids as they are decoded"""
+        while True:
+            token = self.queue.get()
+            if token is None:
+                break
+            yield token
+        if self.error is not None:
+            raise self.error
+
+    def result(self, timeout=None):
+        """
+        Wait for the sequence to finish
+
+        Returns:
+            list: Generated token ids (without the prompt)
+        """
+        if not self.finished.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return self.tokens
+
+
+class GenerationScheduler:
+    """
+    Continuous batching of concurrent generation requests on one model.
+
+    A single worker thread owns the model. Every step it decodes one token for
+    all active sequences in one forward pass, so concurrent callers share the
+    batched matmuls instead of queueing for the whole model. Sequences join and
+    leave the batch at token boundaries: a new request is prefilled on its own,
+    its key/values are left-padded (or the batch's are) to a common length and
+    concatenated into the batch; a sequence that hits EOS or max_new_tokens is
+    dropped from the batch immediately and its caller woken up.
+
+    Each sequence keeps its own attention mask and position ids, so padding
+    never changes its output, and its own sampling parameters.
+
+    Requests with a session_id reuse the key/values of that session's previous
+    turn (see SessionKVCache) and only prefill the part of the prompt that
+    changed. Requests with a prefix_length share one prefill of that fixed
+    preamble with every other request starting the same way (see PrefixKVCache).
+    """
+    def __init__(self, model, tokenizer, device="cpu", max_batch_size=MAX_BATCH_SIZE,
+                 session_cache_budget=SESSION_KV_BUDGET, prefix_cache_budget=PREFIX_KV_BUDGET):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+
+        self.waiting = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+
+        # Batch state, only touched by the worker thread
+        self.active = []
+        self.layers = None
+        self.mask = None
+
+        self.session_cache = SessionKVCache(session_cache_budget) if session_cache_budget else None
+        self.prefix_cache = PrefixKVCache(prefix_cache_budget) if prefix_cache_budget else None
+
+        self.steps = 0
+        self.generated_tokens = 0
+        self.completed = 0
+        self.prefilled_tokens = 0
+        self.reused_tokens = 0
+
+    def submit(self, input_ids, session_id=None, prefix_length=0, **sampling):
+        """
+        Queue a sequence for generation
+
+        Args:
+            input_ids: Prompt token ids
+            session_id: Conversation the prompt continues, for key/value reuse across turns
+            prefix_length: Number of leading tokens that are a fixed preamble shared with other prompts
+            **sampling: max_new_tokens, temperature, top_p, top_k,
+                        repetition_penalty, no_repeat_ngram_size, eos_token_ids
+
+        Returns:
+            GenerationRequest: Call .result() to wait for the generated token ids
+        """
+        if "eos_token_ids" not in sampling:
+            # Chat models often stop on several tokens (e.g. <|im_end|> and <|endoftext|>)
+            generation_config = getattr(self.model, "generation_config", None)
+            eos = getattr(generation_config, "eos_token_id", None) or self.tokenizer.eos_token_id
+            sampling["eos_token_ids"] = eos if isinstance(eos, (list, tuple)) else [eos]
+        request = GenerationRequest(input_ids, session_id=session_id, prefix_length=prefix_length, **sampling)
+        with self.condition:
+            self.waiting.append(request)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="generation-scheduler", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return request
+
+    def generate(self, input_ids, timeout=None, session_id=None, prefix_length=0, **sampling):
+        """Generate for one prompt, blocking until done; returns the generated token ids"""
+        return self.submit(input_ids, session_id=session_id, prefix_length=prefix_length, **sampling).result(timeout)
+
+    def run(self):
+        with torch.inference_mode():
+            while True:
+                with self.condition:
+                    while not self.waiting and not self.active:
+                        self.condition.wait()
+                    admitted = []
+                    while self.waiting and len(self.active) + len(admitted) < self.max_batch_size:
+                        admitted.append(self.waiting.popleft())
+                try:
+                    for request in admitted:
+                        if request.cancelled:
+                            request.close()
+                        else:
+                            self.admit(request)
+                    if self.active:
+                        self.step()
+                except Exception as e:
+                    # e.g. out of memory while merging a request into the batch: fail
+                    # everyone in it rather than let the thread die with callers waiting
+                    logger.error(f"Generation scheduler step failed: {str(e)}")
+                    self.fail(self.active + admitted, e)
+
+    def prefill(self, request):
+        """
+        Run a prompt through the model, starting from any cached key/values of
+        its session or, failing that, of its shared preamble
+
+        Returns:
+            tuple: (per-layer key/values of the whole prompt, logits of the last position)
+        """
+        reused, past = 0, None
+        length = len(request.input_ids)
+        if request.session_id is not None and self.session_cache is not None:
+            reused, past = self.session_cache.lookup(request.session_id, request.input_ids)
+
+        prefix_length = min(request.prefix_length, length - 1)
+        if self.prefix_cache is not None and prefix_length >= MIN_PREFIX_TOKENS and reused < prefix_length:
+            prefix_ids = request.input_ids[:prefix_length]
+            past = self.prefix_cache.lookup(prefix_ids)
+            if past is None:
+                # First prompt with this preamble: prefill it on its own so every later one can start from it
+                prefix = torch.tensor([prefix_ids], device=self.device)
+                outputs = self.model(input_ids=prefix, attention_mask=torch.ones_like(prefix), use_cache=True)
+                past = to_layers(outputs.past_key_values)
+                self.prefix_cache.store(prefix_ids, past)
+                self.prefilled_tokens += prefix_length
+                self.reused_tokens -= prefix_length
+            reused = prefix_length
+        input_ids = torch.tensor([request.input_ids[reused:]], device=self.device)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=torch.ones((1, length), dtype=torch.long, device=self.device),
+            position_ids=torch.arange(reused, length, device=self.device).unsqueeze(0),
+            past_key_values=to_cache(past) if past is not None else None,
+            use_cache=True,
+        )
+        self.reused_tokens += reused
+        self.prefilled_tokens += length - reused
+        return to_layers(outputs.past_key_values), outputs.logits[0, -1]
+
+    def save_session(self, request, layers):
+        """Keep the key/values of a finished sequence (batch size 1, no padding) for its session's next turn"""
+        if request.session_id is None or self.session_cache is None:
+            return
+        # The last sampled token was never fed to the model
+        length = layers[0][0].shape[2]
+        self.session_cache.put(request.session_id, (request.input_ids + request.tokens)[:length], layers)
+
+    def admit(self, request):
+        """Prefill a new request and merge its key/values into the running batch"""
+        try:
+            layers, logits = self.prefill(request)
+            done = request.append(request.sample(logits))
+        except Exception as e:
+            logger.error(f"Prefill failed: {str(e)}")
+            request.close(e)
+            return
+        if done:
+            self.save_session(request, layers)
+            self.finish(request)
+            return
+
+        mask = torch.ones((1, len(request.input_ids)), dtype=torch.long, device=self.device)
+        if not self.active:
+            self.active, self.layers, self.mask = [request], layers, mask
+            return
+        length = max(self.mask.shape[1], mask.shape[1])
+        self.layers, self.mask = left_pad(self.layers, self.mask, length)
+        layers, mask = left_pad(layers, mask, length)
+        self.layers = tuple(
+            (torch.cat([key, new_key], dim=0), torch.cat([value, new_value], dim=0))
+            for (key, value), (new_key, new_value) in zip(self.layers, layers)
+        )
+        self.mask = torch.cat([self.mask, mask], dim=0)
+        self.active.append(request)
+
+    def step(self):
+        """Decode one token for every active sequence"""
+        input_ids = torch.tensor([[request.tokens[-1]] for request in self.active], device=self.device)
+        # Each sequence continues at its own position, whatever padding sits to its left
+        position_ids = self.mask.sum(dim=1, keepdim=True)
+        mask = torch.cat([self.mask, self.mask.new_ones((len(self.active), 1))], dim=1)
+        try:
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=mask,
+                position_ids=position_ids,
+                past_key_values=to_cache(self.layers),
+                use_cache=True,
+            )
+            logits = outputs.logits[:, -1]
+            finished = [request.append(request.sample(logits[i])) for i, request in enumerate(self.active)]
+        except Exception as e:
+            logger.error(f"Decoding step failed: {str(e)}")
+            self.fail(self.active, e)
+            return
+
+        self.layers, self.mask = to_layers(outputs.past_key_values), mask
+        self.steps += 1
+        self.generated_tokens += len(self.active)
+        if any(finished):
+            self.remove([i for i, done in enumerate(finished) if done])
+
+    def remove(self, rows):
+        """Drop finished sequences from the batch and trim padding columns nobody needs any more"""
+        for i in rows:
+            if self.active[i].session_id is not None and self.session_cache is not None:
+                # Copy the row's unpadded positions out of the batch tensors
+                length = int(self.mask[i].sum())
+                self.save_session(self.active[i], tuple(
+                    (key[i:i + 1, :, -length:].clone(), value[i:i + 1, :, -length:].clone())
+                    for key, value in self.layers
+                ))
+            self.finish(self.active[i])
+        rows = set(rows)
+        keep = [i for i in range(len(self.active)) if i not in rows]
+        if not keep:
+            self.active, self.layers, self.mask = [], None, None
+            return
+        index = torch.tensor(keep, device=self.device)
+        self.active = [self.active[i] for i in keep]
+        self.mask = self.mask.index_select(0, index)
+        start = int(self.mask.any(dim=0).nonzero()[0])
+        self.mask = self.mask[:, start:]
+        self.layers = tuple(
+            (key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+            for key, value in self.layers
+        )
+
+    def finish(self, request):
+        self.completed += 1
+        request.close()
+
+    def fail(self, requests, error):
+        """Close every unfinished request with an error and start over with an empty batch"""
+        for request in requests:
+            if not request.finished.is_set():
+                request.close(error)
+        self.active, self.layers, self.mask = [], None, None
+
+    def stats(self):
+        """Queue depth, batch size and token counters of the scheduler"""
+        with self.condition:
+            waiting = len(self.waiting)
+        return {
+            "waiting": waiting,
+            "active": len(self.active),
+            "max_batch_size": self.max_batch_size,
+            "steps": self.steps,
+            "generated_tokens": self.generated_tokens,
+            "completed": self.completed,
+            "mean_batch_size": self.generated_tokens / self.steps if self.steps else 0.0,
+            "prefilled_tokens": self.prefilled_tokens,
+            "reused_tokens": self.reused_tokens,
+            "session_cache": self.session_cache.stats() if self.session_cache is not None else None,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+        }
+
+
+# Process-wide schedulers, one per loaded model
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(key, model, tokenizer, device="cpu", max_batch_size=MAX_BATCH_SIZE):
+    """Return the shared scheduler for a loaded model, creating it on first use"""
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = GenerationScheduler(model, tokenizer, device, max_batch_size)
+        return _schedulers[key]
+
+
+def decode_stream(tokenizer, tokens):
+    """
+    Turn a stream of token ids into a stream of text pieces
+
+    The whole sequence is re-decoded as it grows and only the new suffix is
+    yielded, so multi-token characters and tokenizer spacing come out right;
+    text ending in an incomplete UTF-8 character is held back a token.
+    """
+    generated = []
+    sent = ""
+    for token in tokens:
+        generated.append(token)
+        text = tokenizer.decode(generated, skip_special_tokens=True)
+        if text.endswith("\ufffd") or len(text) <= len(sent):
+            continue
+        yield text[len(sent):]
+        sent = text
@@ -0,0 +1,227 @@
+import os
+import time
+import threading
+import logging
+from rag import collection_paths, get_engine
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """Wakes the indexer thread on any filesystem event in the watched folder"""
+    def __init__(self, indexer):
+        self.indexer = indexer
+
+    def on_any_event(self, event):
+        self.indexer.notify()
+
+
+class BackgroundIndexer:
+    """
+    Keeps a RAGEngine in sync with its documents folder from a background thread.
+
+    The folder is watched with watchdog (inotify and friends) when it is
+    installed and polled otherwise. Every wake-up lists the folder and compares
+    (mtime, size) per file with the last scan, so new, changed and deleted files
+    all end up in the same queue. Once the queue has been quiet for `debounce`
+    seconds (uploads still being written keep changing size) the engine is
+    refreshed; the engine swaps in the new snapshot atomically, so chat requests
+    never wait on indexing.
+    """
+    def __init__(self, engine, poll_interval=2.0, debounce=1.0, use_watchdog=True):
+        self.engine = engine
+        self.directory_path = engine.directory_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_watchdog = use_watchdog and Observer is not None
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.observer = None
+
+        # File name -> (mtime_ns, size) as of the last scan
+        self.snapshot = {}
+        # File name -> (first seen, last seen) times of its unindexed changes
+        self.pending = {}
+        self.last_change = None
+        # The first pass always refreshes, to load any existing store
+        self.force_refresh = True
+
+        self.indexing = False
+        self.progress = {"stage": "idle", "done": 0, "total": 0}
+        self.last_error = None
+        self.last_duration = None
+        self.refresh_count = 0
+
+    def start(self):
+        """Start the watcher thread (and the watchdog observer when available)"""
+        if self.thread is not None:
+            return self
+        os.makedirs(self.directory_path, exist_ok=True)
+        if self.use_watchdog:
+            self.observer = Observer()
+            self.observer.schedule(_WakeHandler(self), self.directory_path, recursive=False)
+            self.observer.daemon = True
+            self.observer.start()
+        self.thread = threading.Thread(target=self.run, name="rag-indexer", daemon=True)
+        # Run the first scan straight away
+        self.wake.set()
+        self.thread.start()
+        logger.info(f"Watching {self.directory_path} with {'watchdog' if self.use_watchdog else 'polling'}")
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wake.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(timeout)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def notify(self):
+        """Ask for an immediate scan, e.g. right after an upload"""
+        self.wake.set()
+
+    def scan(self):
+        """List the folder and queue every file whose stat changed since the last scan"""
+        current = {}
+        try:
+            with os.scandir(self.directory_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+
+        now = time.time()
+        changed = {name for name, key in current.items() if self.snapshot.get(name) != key}
+        changed |= self.snapshot.keys() - current.keys()
+        with self.lock:
+            for name in changed:
+                first_seen = self.pending[name][0] if name in self.pending else now
+                self.pending[name] = (first_seen, now)
+            if changed:
+                self.last_change = now
+        self.snapshot = current
+
+    def run(self):
+        while not self.stopping.is_set():
+            # With watchdog, polling is only a safety net for missed events
+            timeout = self.poll_interval * (10 if self.use_watchdog else 1)
+            if self.wake.wait(timeout if not self.pending else self.debounce):
+                self.wake.clear()
+            if self.stopping.is_set():
+                break
+            if self.engine.closed:
+                # The engine was evicted; the next query loads a new one with its own indexer
+                logger.info(f"Stopped watching {self.directory_path}: its engine was unloaded")
+                self.stopping.set()
+                break
+            self.scan()
+
+            with self.lock:
+                quiet = self.last_change is None or time.time() - self.last_change >= self.debounce
+                due = self.force_refresh or (self.pending and quiet)
+                # Changes seen from here on stay queued for the next refresh
+                batch = dict(self.pending) if due else None
+            if due:
+                self.refresh(batch)
+        if self.observer is not None:
+            self.observer.stop()
+
+    def refresh(self, batch):
+        self.indexing = True
+        self.progress = {"stage": "starting", "done": 0, "total": 0}
+        start = time.time()
+        try:
+            self.engine.refresh(progress=self.report_progress)
+            with self.lock:
+                for name, seen in batch.items():
+                    if self.pending.get(name) == seen:
+                        del self.pending[name]
+            self.force_refresh = False
+            self.last_error = None
+            self.refresh_count += 1
+        except Exception as e:
+            # Keep the changes queued and retry after the next interval
+            logger.error(f"Background indexing failed: {str(e)}")
+            self.last_error = str(e)
+            self.stopping.wait(self.poll_interval)
+        finally:
+            self.last_duration = time.time() - start
+            self.indexing = False
+            self.progress = {"stage": "idle", "done": 0, "total": 0}
+
+    def report_progress(self, stage, done, total):
+        self.progress = {"stage": stage, "done": done, "total": total}
+
+    def status(self):
+        """
+        Freshness, queue depth and progress of the background indexer
+
+        Returns:
+            dict: backend, queue_depth, indexing, progress, index_version,
+                  last_refresh, stale_seconds (age of the oldest unindexed change),
+                  last_duration and last_error
+        """
+        with self.lock:
+            oldest = min(first_seen for first_seen, _ in self.pending.values()) if self.pending else None
+            queue_depth = len(self.pending)
+        return {
+            "backend": "watchdog" if self.use_watchdog else "polling",
+            "running": self.thread is not None and self.thread.is_alive(),
+            "queue_depth": queue_depth,
+            "indexing": self.indexing,
+            "progress": dict(self.progress),
+            "ready": self.engine.rag_system is not None,
+            "index_version": self.engine.index_version,
+            "last_refresh": self.engine.last_refresh,
+            "stale_seconds": time.time() - oldest if oldest is not None else 0.0,
+            "refreshes": self.refresh_count,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+
+# Process-wide indexers, keyed by their engine's paths
+_indexers = {}
+_indexers_lock = threading.Lock()
+
+def start_indexer(directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.db",
+                  poll_interval=2.0, debounce=1.0, collection=None, pin=True):
+    """
+    Start (once per process) a background indexer for the shared engine of the given paths
+
+    The engine is created without an initial scan, so startup does not block on
+    indexing; until the first background refresh lands, queries are answered from
+    the store saved by an earlier run (see RAGEngine.load), if there is one.
+    Pinned engines are never evicted under memory pressure; the indexer of an
+    unpinned engine stops when the engine is evicted, and the next call starts
+    a new one.
+
+    Args:
+        collection: Named collection to watch; overrides the three paths
+        pin: Keep the watched engine loaded
+
+    Returns:
+        BackgroundIndexer: The running indexer
+    """
+    if collection is not None:
+        directory_path, vector_store_path, file_registry_path = collection_paths(collection)
+    key = (directory_path, vector_store_path, file_registry_path)
+    with _indexers_lock:
+        if key not in _indexers or _indexers[key].engine.closed:
+            engine = get_engine(directory_path, vector_store_path, file_registry_path, initial_refresh=False, pin=pin)
+            _indexers[key] = BackgroundIndexer(engine, poll_interval=poll_interval, debounce=debounce).start()
+        return _indexers[key]
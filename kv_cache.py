@@ -0,0 +1,155 @@
+import os
+import array
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Memory the per-session key/value cache may hold, across all sessions of one model
+SESSION_KV_BUDGET = int(os.environ.get("SESSION_KV_BUDGET_MB", "1024")) * 1024 * 1024
+# Memory for shared prompt prefixes (system prompts, agent instructions) of one model
+PREFIX_KV_BUDGET = int(os.environ.get("PREFIX_KV_BUDGET_MB", "256")) * 1024 * 1024
+# Shorter shared prefixes are not worth a separate prefill and cache entry
+MIN_PREFIX_TOKENS = 16
+
+
+def layers_nbytes(layers):
+    """Memory held by per-layer (key, value) tensors"""
+    return sum(key.numel() * key.element_size() + value.numel() * value.element_size() for key, value in layers)
+
+
+def truncate_layers(layers, length):
+    """Key/values of the first length positions"""
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in layers)
+
+
+def common_prefix_length(a, b):
+    """Number of leading tokens two sequences share"""
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class KVCacheStore:
+    """
+    Per-layer key/value tensors by key, evicted least recently used first once
+    they exceed budget_bytes.
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        # key -> (token ids, per-layer key/values, bytes)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def get(self, key):
+        """(token ids, per-layer key/values) stored under key, marking it as recently used, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def record(self, reused):
+        with self.lock:
+            if reused:
+                self.hits += 1
+                self.reused_tokens += reused
+            else:
+                self.misses += 1
+
+    def put(self, key, input_ids, layers):
+        """Store the key/values of a token sequence, replacing any previous entry for key"""
+        size = layers_nbytes(layers)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+            if size > self.budget_bytes:
+                return
+            self.entries[key] = (tuple(input_ids), layers, size)
+            self.size += size
+            while self.size > self.budget_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+
+    def stats(self):
+        """Size and hit/miss counters of the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reused_tokens": self.reused_tokens,
+            }
+
+
+class SessionKVCache(KVCacheStore):
+    """
+    Past key/values of each conversation's last processed sequence, kept between turns.
+
+    A new turn re-renders the whole conversation, but everything up to the
+    first token that differs from the previous turn's sequence (the system
+    prompt and earlier turns) has the same key/values. A lookup returns those
+    positions so only the rest of the prompt needs a prefill; a miss, or a
+    conversation that changed from the start, falls back to a full prefill.
+    """
+    def __init__(self, budget_bytes=SESSION_KV_BUDGET):
+        super().__init__(budget_bytes)
+
+    def lookup(self, session_id, input_ids):
+        """
+        Reusable key/values for a session's new prompt
+
+        At least the last prompt token is always left for the prefill, which
+        has to produce the logits for the first generated token.
+
+        Returns:
+            tuple: (number of reused positions, per-layer key/values), or (0, None) on a miss
+        """
+        entry = self.get(session_id)
+        length = min(common_prefix_length(entry[0], input_ids), len(input_ids) - 1) if entry else 0
+        self.record(max(length, 0))
+        if length <= 0:
+            return 0, None
+        return length, truncate_layers(entry[1], length)
+
+
+class PrefixKVCache(KVCacheStore):
+    """
+    Key/values of shared prompt prefixes, reused across all sessions and callers of a model.
+
+    Callers mark how many leading tokens of a prompt are a fixed preamble (the
+    system prompt, standing agent instructions); those tokens are hashed, and
+    every prompt starting with the same preamble reuses one prefill of it.
+    """
+    def __init__(self, budget_bytes=PREFIX_KV_BUDGET):
+        super().__init__(budget_bytes)
+
+    @staticmethod
+    def prefix_key(prefix_ids):
+        return hashlib.sha256(array.array("q", prefix_ids).tobytes()).hexdigest()
+
+    def lookup(self, prefix_ids):
+        """Cached key/values of exactly these prefix tokens, or None"""
+        entry = self.get(self.prefix_key(prefix_ids))
+        # Guard against hash collisions
+        layers = entry[1] if entry is not None and entry[0] == tuple(prefix_ids) else None
+        self.record(len(prefix_ids) if layers is not None else 0)
+        return layers
+
+    def store(self, prefix_ids, layers):
+        self.put(self.prefix_key(prefix_ids), prefix_ids, layers)
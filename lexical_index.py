@@ -0,0 +1,250 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+import logging
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Query words that match most chunks and carry no signal; their postings are never loaded
+STOPWORDS = frozenset("""
+a an and are as at be by did do does for from had has have how i in is it its of on or
+that the their there these this to was were what when where which who why will with you your
+""".split())
+# Terms in more than this share of chunks add almost nothing to BM25 (idf ~ 0) and are skipped
+MAX_DF_RATIO = 0.5
+# At most this many postings per term are scored, highest term frequency first
+MAX_POSTINGS_PER_TERM = 20000
+
+def tokenize(text):
+    """Lower-cased word tokens; keeps numbers, tickers and names intact"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    Persistent BM25 inverted index backed by SQLite.
+
+    Postings are stored per (term, chunk id), so chunks can be added and removed
+    one at a time alongside the FAISS store instead of rebuilding an in-memory
+    BM25 model over the whole corpus.
+    """
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One writer connection; readers get their own connection per thread
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                chunk_id TEXT PRIMARY KEY,
+                length INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT,
+                chunk_id TEXT,
+                tf INTEGER,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+            -- Serves a term's postings highest tf first, so LIMIT stops early instead of sorting them all
+            CREATE INDEX IF NOT EXISTS postings_term_tf ON postings (term, tf DESC);
+            -- Document frequency per term, kept up to date by add() and remove()
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value REAL
+            );
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('doc_count', 0), ('total_length', 0), ('terms_ready', 0);
+        """)
+        if not self.conn.execute("SELECT value FROM meta WHERE key = 'terms_ready'").fetchone()[0]:
+            # Index written before the terms table existed: count its postings once
+            self.conn.execute("DELETE FROM terms")
+            self.conn.execute("INSERT INTO terms (term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+            self.conn.execute("UPDATE meta SET value = 1 WHERE key = 'terms_ready'")
+        self.conn.commit()
+
+    def _reader(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the writer connection; per-thread readers close when their threads exit"""
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        return int(self._reader().execute("SELECT value FROM meta WHERE key = 'doc_count'").fetchone()[0])
+
+    def ids(self):
+        """Chunk ids currently indexed"""
+        return {row[0] for row in self._reader().execute("SELECT chunk_id FROM docs")}
+
+    def add(self, chunks):
+        """
+        Index new chunks
+
+        Args:
+            chunks: Iterable of (chunk_id, text) pairs; ids already indexed are skipped
+        """
+        with self.lock, self.conn:
+            added = 0
+            total_length = 0
+            df_delta = Counter()
+            for chunk_id, text in chunks:
+                terms = Counter(tokenize(text))
+                length = sum(terms.values())
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO docs (chunk_id, length) VALUES (?, ?)", (chunk_id, length)
+                )
+                if cursor.rowcount == 0:
+                    continue
+                self.conn.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in terms.items()]
+                )
+                df_delta.update(terms.keys())
+                added += 1
+                total_length += length
+            self._update_meta(added, total_length)
+            self._update_terms(df_delta)
+        return added
+
+    def remove(self, chunk_ids):
+        """Remove chunks from the index"""
+        with self.lock, self.conn:
+            removed = 0
+            total_length = 0
+            df_delta = Counter()
+            for chunk_id in chunk_ids:
+                row = self.conn.execute("SELECT length FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                df_delta.subtract(term for (term,) in self.conn.execute(
+                    "SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)
+                ))
+                self.conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+                self.conn.execute("DELETE FROM docs WHERE chunk_id = ?", (chunk_id,))
+                removed += 1
+                total_length += row[0]
+            self._update_meta(-removed, -total_length)
+            self._update_terms(df_delta)
+        return removed
+
+    def _update_meta(self, doc_delta, length_delta):
+        self.conn.execute("UPDATE meta SET value = value + ? WHERE key = 'doc_count'", (doc_delta,))
+        self.conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_length'", (length_delta,))
+
+    def _update_terms(self, df_delta):
+        """Apply per-term document frequency changes; terms left in no chunk are dropped"""
+        if not df_delta:
+            return
+        self.conn.executemany("INSERT OR IGNORE INTO terms (term, df) VALUES (?, 0)", [(term,) for term in df_delta])
+        self.conn.executemany("UPDATE terms SET df = df + ? WHERE term = ?", [(delta, term) for term, delta in df_delta.items()])
+        self.conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def sync(self, vector_store):
+        """
+        Make the index hold exactly the chunks of a vector store
+
+        Only the difference is applied, so this is cheap after an incremental
+        update and rebuilds everything when the index file is new.
+        """
+        store_ids = set(vector_store.index_to_docstore_id.values())
+        indexed_ids = self.ids()
+        stale = indexed_ids - store_ids
+        missing = store_ids - indexed_ids
+        if stale:
+            self.remove(stale)
+        if missing:
+            self.add((chunk_id, vector_store.docstore.search(chunk_id).page_content) for chunk_id in missing)
+        if stale or missing:
+            logger.info(f"Lexical index: {len(missing)} chunks added, {len(stale)} removed")
+
+    def search(self, query, k=5, allowed_ids=None):
+        """
+        BM25 search over the inverted index
+
+        Query stopwords and terms found in more than MAX_DF_RATIO of the chunks
+        are skipped (unless nothing else is left), and at most
+        MAX_POSTINGS_PER_TERM postings are read per term, so a common word never
+        pulls a large share of the index into memory.
+
+        Args:
+            query: Query text
+            k: Number of results
+            allowed_ids: Optional set of chunk ids to restrict scoring to
+
+        Returns:
+            list: (chunk_id, score) pairs, best first
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        conn = self._reader()
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        doc_count = meta.get("doc_count", 0)
+        if not doc_count:
+            return []
+        avg_length = meta["total_length"] / doc_count
+
+        # Document frequencies are one row each in the terms table, without touching any postings
+        document_frequency = {}
+        for term in terms - STOPWORDS or terms:
+            row = conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+            if row is not None and row[0] > 0:
+                document_frequency[term] = row[0]
+        selective = {term: df for term, df in document_frequency.items() if df <= MAX_DF_RATIO * doc_count}
+        if not selective and document_frequency:
+            # Only common words in the query: score by the rarest of them
+            term = min(document_frequency, key=document_frequency.get)
+            selective = {term: document_frequency[term]}
+
+        scores = defaultdict(float)
+        for term, df in selective.items():
+            # Walks postings_term_tf from the top and stops after the limit
+            rows = conn.execute(
+                "SELECT p.chunk_id, p.tf, d.length FROM postings p INDEXED BY postings_term_tf "
+                "JOIN docs d ON d.chunk_id = p.chunk_id "
+                "WHERE p.term = ? ORDER BY p.tf DESC LIMIT ?", (term, MAX_POSTINGS_PER_TERM)
+            ).fetchall()
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for chunk_id, tf, length in rows:
+                if allowed_ids is not None and chunk_id not in allowed_ids:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several ranked lists of ids with reciprocal rank fusion
+
+    Args:
+        rankings: Lists of ids, best first
+        k: RRF damping constant
+
+    Returns:
+        list: Ids ordered by fused score
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
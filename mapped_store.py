@@ -0,0 +1,274 @@
+import os
+import re
+import json
+import shutil
+import logging
+from collections.abc import Mapping
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.docstore.document import Document
+from metadata_filter import FILTER_POSITIONS_FILE, FILTERS_FILE, MetadataFilterIndex, build_filter_index, write_filter_index
+
+logger = logging.getLogger(__name__)
+
+# Chunk ids are stored as fixed-width ASCII records
+ID_WIDTH = 64
+
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.jsonl"
+OFFSETS_FILE = "docs.offsets"
+IDS_FILE = "ids.bin"
+SORTED_IDS_FILE = "ids.sorted"
+SORTED_POSITIONS_FILE = "ids.order"
+MANIFEST_FILE = "manifest.json"
+# Every save writes a new v<N>/ directory; the manifest names the current one
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+# Versions kept on disk, so a reader that read the previous manifest can still open its files
+KEEP_VERSIONS = 2
+# Data files of stores saved before versioning, directly in the store directory
+LEGACY_FILES = (INDEX_FILE, DOCS_FILE, OFFSETS_FILE, IDS_FILE, SORTED_IDS_FILE, SORTED_POSITIONS_FILE,
+                FILTER_POSITIONS_FILE, FILTERS_FILE, "index.pkl")
+
+
+class MappedIds(Mapping):
+    """Read-only position -> chunk id mapping over a memory-mapped fixed-width id file"""
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.ids):
+            raise KeyError(position)
+        return self.ids[position].decode("ascii")
+
+    def __iter__(self):
+        return iter(range(len(self.ids)))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class MappedDocstore:
+    """
+    Read-only docstore over an offset-indexed JSON lines file.
+
+    Documents are stored in index position order; chunk ids are resolved to
+    positions by binary search over a sorted, memory-mapped id array, so
+    nothing is unpickled or copied into the Python heap up front.
+    """
+    def __init__(self, path, count):
+        self.docs = np.memmap(os.path.join(path, DOCS_FILE), dtype=np.uint8, mode='r') if count else np.empty(0, np.uint8)
+        self.offsets = _map(os.path.join(path, OFFSETS_FILE), np.uint64, count + 1)
+        self.sorted_ids = _map(os.path.join(path, SORTED_IDS_FILE), f"S{ID_WIDTH}", count)
+        self.sorted_positions = _map(os.path.join(path, SORTED_POSITIONS_FILE), np.int64, count)
+
+    def position_of(self, doc_id):
+        """Index position of a chunk id, or None"""
+        key = doc_id.encode("ascii")
+        i = int(np.searchsorted(self.sorted_ids, key))
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == key:
+            return int(self.sorted_positions[i])
+        return None
+
+    def document_at(self, position):
+        """Load the document stored at an index position"""
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        record = json.loads(bytes(self.docs[start:end]).decode("utf-8"))
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def search(self, search):
+        position = self.position_of(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.document_at(position)
+
+    def add(self, texts):
+        raise NotImplementedError("MappedDocstore is read-only; load the store with load_vector_store to modify it")
+
+    def delete(self, ids):
+        raise NotImplementedError("MappedDocstore is read-only; load the store with load_vector_store to modify it")
+
+
+def _map(path, dtype, count):
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def _replace(path, write):
+    """Write a file through a temporary name and atomically move it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def has_mapped_store(path):
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def has_vector_store(path):
+    """Whether a vector store (memory-mappable or pickled) has been saved at path"""
+    return has_mapped_store(path) or os.path.exists(os.path.join(path, INDEX_FILE))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE), 'r') as f:
+        return json.load(f)
+
+
+def store_directory(path, manifest=None):
+    """Directory holding the data files of the current version (the store itself for unversioned stores)"""
+    version = (manifest if manifest is not None else read_manifest(path)).get("version")
+    return os.path.join(path, version) if version else path
+
+
+def _versions(path):
+    """Version numbers of the v<N> directories in a store, oldest first"""
+    numbers = []
+    for name in os.listdir(path):
+        match = VERSION_PATTERN.match(name)
+        if match and os.path.isdir(os.path.join(path, name)):
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+
+def _new_version_directory(path):
+    """Create and claim the next v<N> directory (makedirs fails if another writer got there first)"""
+    number = (_versions(path) or [0])[-1] + 1
+    while True:
+        try:
+            os.makedirs(os.path.join(path, f"v{number}"))
+            return f"v{number}"
+        except FileExistsError:
+            number += 1
+
+
+def _remove_old_versions(path, current):
+    """Delete superseded versions beyond KEEP_VERSIONS and the files of an unversioned store"""
+    current_number = int(VERSION_PATTERN.match(current).group(1))
+    superseded = [number for number in _versions(path) if number < current_number]
+    for number in superseded[:max(len(superseded) - (KEEP_VERSIONS - 1), 0)]:
+        shutil.rmtree(os.path.join(path, f"v{number}"), ignore_errors=True)
+    # Open memory maps keep their pages after the files are unlinked
+    for name in LEGACY_FILES:
+        legacy_path = os.path.join(path, name)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+
+def save_vector_store(vector_store, path, chunk_version=None):
+    """
+    Save a langchain FAISS store in the memory-mappable format
+
+    chunk_version is recorded in the manifest so callers can tell when stored
+    chunks were built with older chunking or metadata rules.
+
+    Every save writes a complete new version directory (path/v<N>/) and then
+    replaces the manifest, which names the current version, in one atomic
+    rename. Readers resolve the version once and open all files from it, so
+    they always see one consistent snapshot; a crash mid-save leaves the
+    previous version current.
+    """
+    os.makedirs(path, exist_ok=True)
+    version = _new_version_directory(path)
+    directory = os.path.join(path, version)
+    count = vector_store.index.ntotal
+    ids = [vector_store.index_to_docstore_id[i] for i in range(count)]
+
+    offsets = np.zeros(count + 1, dtype=np.uint64)
+    metadatas = []
+    def write_docs(f):
+        position = 0
+        for i, doc_id in enumerate(ids):
+            doc = vector_store.docstore.search(doc_id)
+            metadatas.append(doc.metadata)
+            line = (json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}) + "\n").encode("utf-8")
+            f.write(line)
+            position += len(line)
+            offsets[i + 1] = position
+
+    id_array = np.array(ids, dtype=f"S{ID_WIDTH}")
+    order = np.argsort(id_array, kind="stable").astype(np.int64)
+
+    faiss.write_index(vector_store.index, os.path.join(directory, INDEX_FILE))
+    _replace(os.path.join(directory, DOCS_FILE), write_docs)
+    _replace(os.path.join(directory, OFFSETS_FILE), lambda f: f.write(offsets.tobytes()))
+    _replace(os.path.join(directory, IDS_FILE), lambda f: f.write(id_array.tobytes()))
+    _replace(os.path.join(directory, SORTED_IDS_FILE), lambda f: f.write(id_array[order].tobytes()))
+    _replace(os.path.join(directory, SORTED_POSITIONS_FILE), lambda f: f.write(order.tobytes()))
+    write_filter_index(directory, build_filter_index(metadatas), _replace)
+
+    # Publishing the manifest is the single step that switches readers to the new version
+    manifest = {"version": version, "count": count, "id_width": ID_WIDTH, "chunk_version": chunk_version}
+    _replace(os.path.join(path, MANIFEST_FILE), lambda f: f.write(json.dumps(manifest).encode("utf-8")))
+    _remove_old_versions(path, version)
+
+
+def _migrate_pickle_store(path, embeddings):
+    """One-off conversion of a store saved with FAISS.save_local"""
+    logger.info(f"Converting pickled vector store in {path} to the memory-mapped format")
+    vector_store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    save_vector_store(vector_store, path)
+
+
+def _open_documents(path, embeddings):
+    """
+    Memory-mapped docstore and id mapping of a saved store, converting a pickled store first
+
+    Returns:
+        tuple: (docstore, ids, directory of the version they were read from)
+    """
+    if not has_mapped_store(path):
+        _migrate_pickle_store(path, embeddings)
+    manifest = read_manifest(path)
+    directory = store_directory(path, manifest)
+    count = manifest["count"]
+    ids = MappedIds(_map(os.path.join(directory, IDS_FILE), f"S{ID_WIDTH}", count))
+    return MappedDocstore(directory, count), ids, directory
+
+
+def load_mapped_vector_store(path, embeddings):
+    """
+    Open a vector store for querying without reading it into memory
+
+    The FAISS index is memory-mapped where the index type supports it, and the
+    documents and ids are served from memory-mapped files, so several processes
+    share the same pages and startup does not depend on corpus size.
+    """
+    docstore, ids, directory = _open_documents(path, embeddings)
+
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE), flags)
+    except RuntimeError:
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE))
+
+    vector_store = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=ids,
+    )
+    # Metadata pre-filter index (stores saved before it existed have none until their next save)
+    vector_store.filter_index = MetadataFilterIndex.load(directory) if MetadataFilterIndex.exists(directory) else None
+    return vector_store
+
+
+def load_vector_store(path, embeddings):
+    """
+    Load a writable copy of a vector store for incremental updates
+
+    Reads the same files as load_mapped_vector_store but into a regular
+    in-memory index and docstore, without unpickling anything.
+    """
+    docstore, mapped_ids, directory = _open_documents(path, embeddings)
+    ids = [mapped_ids[i] for i in range(len(mapped_ids))]
+    docs = {doc_id: docstore.document_at(i) for i, doc_id in enumerate(ids)}
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.read_index(os.path.join(directory, INDEX_FILE)),
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
@@ -0,0 +1,188 @@
+import os
+import json
+import numpy as np
+import faiss
+
+# Chunk metadata fields that get a value -> positions index
+FILTER_FIELDS = ("source", "file_type", "page", "uploaded")
+
+FILTERS_FILE = "filters.json"
+FILTER_POSITIONS_FILE = "filters.bin"
+
+RANGE_OPERATORS = {
+    "gt": lambda value, bound: value > bound,
+    "gte": lambda value, bound: value >= bound,
+    "lt": lambda value, bound: value < bound,
+    "lte": lambda value, bound: value <= bound,
+}
+
+
+def build_filter_index(metadatas):
+    """
+    Group index positions by metadata value
+
+    Args:
+        metadatas: Metadata dict of each stored chunk, in index position order
+
+    Returns:
+        dict: {field: {value: [positions]}} for every field in FILTER_FIELDS
+    """
+    groups = {field: {} for field in FILTER_FIELDS}
+    for position, metadata in enumerate(metadatas):
+        for field in FILTER_FIELDS:
+            value = metadata.get(field)
+            if value is not None:
+                groups[field].setdefault(value, []).append(position)
+    return groups
+
+
+def pack_filter_index(groups):
+    """
+    Lay out a filter index as one int64 array of positions plus a directory of (offset, count) per value
+
+    Returns:
+        tuple: (directory {field: {JSON value: [offset, count]}}, positions array)
+    """
+    directory = {}
+    arrays = []
+    offset = 0
+    for field, values in groups.items():
+        directory[field] = {}
+        for value, positions in values.items():
+            directory[field][json.dumps(value)] = [offset, len(positions)]
+            arrays.append(np.asarray(positions, dtype=np.int64))
+            offset += len(positions)
+    data = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    return directory, data
+
+
+def write_filter_index(path, groups, replace):
+    """
+    Save a filter index next to a vector store
+
+    Args:
+        path: Vector store directory
+        groups: Output of build_filter_index
+        replace: Callable(path, write) that writes a file atomically
+    """
+    directory, data = pack_filter_index(groups)
+    replace(os.path.join(path, FILTER_POSITIONS_FILE), lambda f: f.write(data.tobytes()))
+    replace(os.path.join(path, FILTERS_FILE), lambda f: f.write(json.dumps(directory).encode("utf-8")))
+
+
+class MetadataFilterIndex:
+    """
+    Pre-filter index from metadata values to sorted FAISS positions.
+
+    Each (field, value) owns a sorted slice of one memory-mapped position array,
+    so a filter resolves to an id set by slicing, merging and intersecting
+    arrays, without touching any vectors or documents.
+
+    Filters map fields to a value, a list of accepted values, or a range dict
+    such as {"gte": 3, "lte": 7}; all fields must match, e.g.
+    {"source": "case.pdf", "page": {"gte": 3, "lte": 7}}.
+    """
+    def __init__(self, directory, positions_data):
+        self.directory = directory
+        self.positions_data = positions_data
+
+    @classmethod
+    def load(cls, path):
+        """Open the filter index saved with a vector store, memory-mapping its positions"""
+        with open(os.path.join(path, FILTERS_FILE), 'r') as f:
+            directory = json.load(f)
+        size = os.path.getsize(os.path.join(path, FILTER_POSITIONS_FILE)) // 8
+        positions_data = (
+            np.memmap(os.path.join(path, FILTER_POSITIONS_FILE), dtype=np.int64, mode='r', shape=(size,))
+            if size else np.empty(0, dtype=np.int64)
+        )
+        return cls(directory, positions_data)
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """Build a filter index in memory by reading every document of a vector store"""
+        ids = vector_store.index_to_docstore_id
+        metadatas = (vector_store.docstore.search(ids[i]).metadata for i in range(vector_store.index.ntotal))
+        return cls(*pack_filter_index(build_filter_index(metadatas)))
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, FILTERS_FILE))
+
+    def values(self, field):
+        """Distinct values of a field"""
+        return [json.loads(key) for key in self.directory.get(field, {})]
+
+    def _slice(self, field, key):
+        offset, count = self.directory[field][key]
+        return self.positions_data[offset:offset + count]
+
+    def field_positions(self, field, condition):
+        if field not in self.directory:
+            raise ValueError(f"Cannot filter on {field!r}; filterable fields are {FILTER_FIELDS}")
+        keys = self.directory[field]
+        if isinstance(condition, dict):
+            matched = []
+            for key in keys:
+                value = json.loads(key)
+                try:
+                    if all(RANGE_OPERATORS[op](value, bound) for op, bound in condition.items()):
+                        matched.append(key)
+                except TypeError:
+                    continue
+        elif isinstance(condition, (list, tuple, set)):
+            matched = [json.dumps(value) for value in condition if json.dumps(value) in keys]
+        else:
+            matched = [json.dumps(condition)] if json.dumps(condition) in keys else []
+
+        if not matched:
+            return np.empty(0, dtype=np.int64)
+        if len(matched) == 1:
+            return np.asarray(self._slice(field, matched[0]))
+        return np.unique(np.concatenate([self._slice(field, key) for key in matched]))
+
+    def positions(self, filter):
+        """
+        Sorted FAISS positions of the chunks matching a filter
+
+        Returns:
+            numpy.ndarray: int64 positions, or None if the filter is empty
+        """
+        if not filter:
+            return None
+        result = None
+        # Intersect the most selective fields first
+        for field_result in sorted((self.field_positions(field, condition) for field, condition in filter.items()), key=len):
+            result = field_result if result is None else np.intersect1d(result, field_result, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
+
+
+def search_positions(index, query_vector, positions, k):
+    """
+    Search only the given FAISS positions of an index
+
+    The id selector is checked inside the index scan, so non-matching vectors
+    are skipped before distances are computed instead of being over-fetched
+    and discarded afterwards.
+
+    Returns:
+        tuple: (distances, positions) of the best k matches, best first
+    """
+    k = min(k, len(positions))
+    if k == 0:
+        return [], []
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(positions, dtype=np.int64))
+    if isinstance(index, faiss.IndexIVF):
+        # IVF lists may not hold any selected vector within nprobe; widen the probe for small selections
+        nprobe = index.nlist if len(positions) < 10 * k else index.nprobe
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    query = np.asarray([query_vector], dtype=np.float32)
+    distances, labels = index.search(query, k, params=params)
+    found = [(float(d), int(i)) for d, i in zip(distances[0], labels[0]) if i != -1]
+    return [d for d, _ in found], [i for _, i in found]
@@ -0,0 +1,334 @@
+"""
+Local inference server for the lightweight chat models.
+
+One process per machine loads each model once and serves generation over
+HTTP on localhost, so the Flask app, training scripts and notebooks share a
+single copy of the weights instead of each loading their own. The Hugging
+Face login also happens once, when the server starts.
+
+Run it with:
+
+    python model_server.py --preload meta-llama/Llama-3.2-3B-Instruct
+
+Clients (see lightweight.chat) POST JSON to /generate and fall back to
+generating in-process when no server is listening.
+"""
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+import gc
+import json
+import logging
+import argparse
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from dotenv import load_dotenv
+from huggingface_hub import login as hf_login
+from generation import get_scheduler, shared_prefix_length
+from quantization import quantize_model, DEFAULT_QUANTIZATION, QUANTIZATION_MODES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "meta-llama/Llama-3.2-3B-Instruct"
+SYSTEM_PROMPT = "You are a helpful, precise, and accurate assistant."
+MODEL_SERVER_HOST = os.environ.get("MODEL_SERVER_HOST", "127.0.0.1")
+MODEL_SERVER_PORT = int(os.environ.get("MODEL_SERVER_PORT", "8765"))
+MODEL_SERVER_URL = os.environ.get("MODEL_SERVER_URL", f"http://{MODEL_SERVER_HOST}:{MODEL_SERVER_PORT}")
+# Generating a few hundred tokens on CPU can take minutes
+MODEL_SERVER_TIMEOUT = 600
+
+# Loaded (model, tokenizer) pairs, keyed by (model name, quantization)
+model_cache = {}
+_model_lock = threading.Lock()
+_logged_in = False
+
+
+def login():
+    """Log in to the Hugging Face Hub once per process (gated models such as Llama need it)"""
+    global _logged_in
+    if _logged_in:
+        return
+    load_dotenv()
+    token = os.environ.get("HF_TOKEN")
+    if token:
+        hf_login(token)
+    else:
+        logger.warning("HF_TOKEN is not set; only public models can be downloaded")
+    _logged_in = True
+
+
+def get_device():
+    # Works on both Mac and Ubuntu
+    if torch.cuda.is_available():
+        return "cuda"
+    if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        return "mps"  # Apple Silicon
+    return "cpu"
+
+
+def get_model(model_name=DEFAULT_MODEL_NAME, quantization=None):
+    """
+    Load a model and its tokenizer once per process and load mode
+
+    Args:
+        model_name (str): Hugging Face model identifier
+        quantization (str): "none", "int8" or "int4"; defaults to MODEL_QUANTIZATION
+
+    Returns:
+        tuple: (model, tokenizer, device)
+    """
+    device = get_device()
+    key = (model_name, quantization or DEFAULT_QUANTIZATION)
+    with _model_lock:
+        if key not in model_cache:
+            login()
+            logger.info(f"Loading model {model_name} on {device} ({key[1]})")
+
+            # Load tokenizer with correct padding configuration
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+
+            # Load model with optimizations
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                torch_dtype=torch.float16 if device in ["cuda", "mps"] else torch.float32,
+                low_cpu_mem_usage=True,
+            )
+            model.to(device)
+            model.eval()
+            model_cache[key] = (quantize_model(model, key[1], device), tokenizer)
+        model, tokenizer = model_cache[key]
+    return model, tokenizer, device
+
+
+def build_inputs(tokenizer, model_name, prompt, context, instructions=None):
+    """
+    Format a prompt according to the model's template and tokenize it
+
+    Args:
+        instructions: Standing instructions placed right after the system prompt,
+                      ahead of anything that changes between calls
+
+    Returns:
+        tuple: (input_ids list, preamble text every prompt with the same
+               instructions starts with, or None if the prompt opens with
+               per-conversation context)
+    """
+    system_prompt = f"{SYSTEM_PROMPT}\n{instructions.strip()}" if instructions else SYSTEM_PROMPT
+    if "TinyLlama" in model_name and "Chat" in model_name:
+        # Use messages format for TinyLlama-Chat
+        messages = context + [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        if hasattr(tokenizer, "apply_chat_template"):
+            chat_text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            # Only the fixed system message is worth sharing; prior turns differ per conversation
+            preamble = None if context else tokenizer.apply_chat_template(messages[-2:-1], tokenize=False)
+        else:
+            # Manual template as fallback
+            chat_text = f"<|system|>\n{system_prompt}\n<|user|>\n{prompt}\n<|assistant|>"
+            preamble = f"<|system|>\n{system_prompt}\n"
+        return tokenizer(chat_text)["input_ids"], preamble
+
+    # Generic format for other models
+    preamble = f"""{system_prompt}
+Please provide a clear, factual response to the following:
+
+"""
+    enhanced_prompt = f"""{preamble}{prompt}
+
+Answer:"""
+    return tokenizer(enhanced_prompt)["input_ids"], preamble
+
+
+def extract_response(tokenizer, input_ids, tokens, prompt):
+    """Decode the generated tokens, recovering the answer from the full output if they decode to nothing"""
+    response = tokenizer.decode(tokens, skip_special_tokens=True).strip()
+    if response:
+        return response
+
+    full_output = tokenizer.decode(input_ids + tokens, skip_special_tokens=True)
+    # Try various methods to extract the response
+    if "<|assistant|>" in full_output:
+        return full_output.split("<|assistant|>")[-1].strip()
+    if "Answer:" in full_output:
+        return full_output.split("Answer:")[-1].strip()
+    if prompt in full_output:
+        return full_output.split(prompt)[-1].strip()
+    # Just return the last part of the output
+    return full_output[-500:].strip()
+
+
+def generate(prompt, model_name=DEFAULT_MODEL_NAME, max_new_tokens=200, temperature=0.1, context=[], instructions=None, quantization=None):
+    """
+    Generate a response with a model loaded in this process
+
+    Concurrent calls for the same model are decoded together by its
+    GenerationScheduler, and the key/values of the fixed preamble (system
+    prompt plus instructions) are computed once and shared by all of them.
+
+    Args:
+        prompt (str): The user's query or prompt
+        model_name (str): Hugging Face model identifier
+        max_new_tokens (int): Maximum number of tokens to generate
+        temperature (float): Controls randomness (lower = more deterministic)
+        context (list): Previous messages, used by chat-template models
+        instructions (str): Standing instructions that stay the same across calls
+        quantization (str): Load mode "none", "int8" or "int4"; defaults to MODEL_QUANTIZATION
+
+    Returns:
+        str: The model's response
+    """
+    quantization = quantization or DEFAULT_QUANTIZATION
+    model, tokenizer, device = get_model(model_name, quantization)
+    input_ids, preamble = build_inputs(tokenizer, model_name, prompt, context, instructions)
+
+    # Generate with optimal parameters for the model
+    tokens = get_scheduler((model_name, quantization), model, tokenizer, device).generate(
+        input_ids,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=0.95,
+        top_k=50,
+        repetition_penalty=1.4,
+        no_repeat_ngram_size=3,
+        eos_token_ids=[tokenizer.eos_token_id],
+        prefix_length=shared_prefix_length(tokenizer, preamble, input_ids) if preamble else 0,
+    )
+
+    response = extract_response(tokenizer, input_ids, tokens, prompt)
+    gc.collect()
+    return response
+
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP:
+
+        POST /generate  {"prompt", "model_name", "max_new_tokens", "temperature", "context",
+                         "instructions", "quantization"} -> {"response"}
+        GET  /health    -> {"status": "ok", "models": [loaded model names], "schedulers": {name: batching stats}}
+    """
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(200, {
+            "status": "ok",
+            "models": [f"{name} ({quantization})" for name, quantization in list(model_cache)],
+            "schedulers": {
+                f"{name} ({quantization})": get_scheduler((name, quantization), *get_model(name, quantization)).stats()
+                for name, quantization in list(model_cache)
+            },
+        })
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+            prompt = data.pop("prompt")
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"Invalid request: {str(e)}"})
+            return
+        try:
+            response = generate(prompt, **data)
+        except Exception as e:
+            logger.error(f"Generation failed: {str(e)}")
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, {"response": response})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host=MODEL_SERVER_HOST, port=MODEL_SERVER_PORT, preload=(), quantization=None):
+    """
+    Log in, load the preloaded models and serve generation requests until interrupted
+
+    Args:
+        host: Interface to bind; keep it on localhost, the server has no authentication
+        port: TCP port
+        preload: Model names to load before accepting requests
+        quantization: Load mode for requests that do not pick one ("none", "int8" or "int4")
+    """
+    global DEFAULT_QUANTIZATION
+    DEFAULT_QUANTIZATION = quantization or DEFAULT_QUANTIZATION
+    login()
+    for model_name in preload:
+        get_model(model_name)
+    server = ThreadingHTTPServer((host, port), ModelRequestHandler)
+    server.daemon_threads = True
+    logger.info(f"Model server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request_generation(payload, url=MODEL_SERVER_URL, timeout=MODEL_SERVER_TIMEOUT):
+    """
+    Ask a running model server to generate
+
+    Raises:
+        ConnectionRefusedError: No server is listening at url
+        RuntimeError: The server failed to generate, or the connection broke or
+                      timed out on the way
+
+    Returns:
+        str: The model's response
+    """
+    request = urllib.request.Request(
+        f"{url}/generate",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())["response"]
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"Model server error: {e.read().decode('utf-8', 'replace')}")
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, ConnectionRefusedError):
+            raise ConnectionRefusedError(f"No model server at {url}")
+        raise RuntimeError(f"Model server request failed: {e.reason}")
+    except (OSError, http.client.HTTPException) as e:
+        # Reset, broken pipe or timeout once the server had accepted the request
+        raise RuntimeError(f"Model server request failed: {e!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the lightweight chat models over HTTP on localhost")
+    parser.add_argument("--host", default=MODEL_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=MODEL_SERVER_PORT)
+    parser.add_argument("--preload", nargs="*", default=[DEFAULT_MODEL_NAME],
+                        help="Models to load at startup (others load on first request)")
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES, default=DEFAULT_QUANTIZATION,
+                        help="Weight quantization for CPU inference (LoRA adapters are merged first)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    serve(args.host, args.port, args.preload, args.quantization)
+
+
+if __name__ == "__main__":
+    main()
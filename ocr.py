@@ -0,0 +1,146 @@
+import os
+import zlib
+import hashlib
+import logging
+import pytesseract
+from PIL import Image
+from pdf2image import convert_from_path
+from worker_pool import run_with_deadline
+
+logger = logging.getLogger(__name__)
+
+# Rasterization resolution for scanned PDF pages; plenty for 10pt+ text at a
+# fraction of the pixels (and tesseract time) of 300 DPI
+OCR_DPI = 200
+# Longest side, in pixels, that image files are scaled down to before OCR
+MAX_IMAGE_SIDE = 3500
+OCR_CACHE_DIR = "ocr_cache"
+
+
+def image_hash(image):
+    """Hash of an image's pixels, independent of the file or PDF it came from"""
+    digest = hashlib.sha256(f"{image.mode}|{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    OCR results on disk, keyed by image hash.
+
+    One compressed file per image, written through a temporary name, so any
+    number of worker processes can read and fill the cache concurrently.
+    """
+    def __init__(self, path=OCR_CACHE_DIR):
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.txt.z")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except (FileNotFoundError, zlib.error):
+            return None
+
+    def put(self, key, text):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(text.encode("utf-8")))
+        os.replace(tmp_path, path)
+
+
+def rasterize_page(filepath, page, dpi=OCR_DPI):
+    """Render a single 1-based PDF page as a grayscale image"""
+    return convert_from_path(filepath, dpi=dpi, first_page=page, last_page=page, grayscale=True)[0]
+
+
+def load_image(filepath, max_side=MAX_IMAGE_SIDE):
+    """Open an image file as grayscale, scaled down if it is larger than OCR needs"""
+    image = Image.open(filepath)
+    image.load()
+    image = image.convert("L")
+    if max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    return image
+
+
+def _init_worker():
+    # Each worker runs one tesseract at a time; let the pool provide the parallelism
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _ocr_job(filepath, page, dpi, cache_dir, lang):
+    """Pool entry point: rasterize (PDF page) or load (image file), then OCR unless cached"""
+    image = rasterize_page(filepath, page, dpi) if page is not None else load_image(filepath)
+    key = image_hash(image)
+    cache = OCRCache(cache_dir)
+    text = cache.get(key)
+    if text is None:
+        text = pytesseract.image_to_string(image, lang=lang)
+        cache.put(key, text)
+    return text
+
+
+class OCREngine:
+    """
+    Parallel OCR of scanned PDF pages and image files.
+
+    Jobs are (filepath, page) pairs, with page=None for image files. Each job
+    rasterizes its page at a fixed DPI inside the worker, hashes the pixels and
+    only runs tesseract if the hash is not in the OCR cache, so re-uploaded or
+    duplicated scans cost a rasterization instead of a full OCR pass.
+    """
+    def __init__(self, dpi=OCR_DPI, workers=None, cache_dir=OCR_CACHE_DIR, lang="eng", timeout=300):
+        self.dpi = dpi
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.lang = lang
+        self.timeout = timeout
+
+    def run(self, jobs):
+        """
+        OCR many pages and images
+
+        Args:
+            jobs: List of (filepath, page) pairs; page is 1-based, or None for an image file
+
+        Each job gets `timeout` seconds from the moment a worker picks it up; a
+        worker stuck in tesseract is killed and replaced (see worker_pool).
+        A single page or image goes through a worker as well; jobs only run in
+        this process when timeout is None or 0.
+
+        Returns:
+            list: Text per job in the same order; None for jobs that failed or timed out
+        """
+        args = [(filepath, page, self.dpi, self.cache_dir, self.lang) for filepath, page in jobs]
+        workers = max(1, min(self.workers or os.cpu_count() or 1, len(args)))
+        if not self.timeout:
+            # No time limit: OCR in this process
+            results = []
+            for (filepath, page), job in zip(jobs, args):
+                try:
+                    results.append(_ocr_job(*job))
+                except Exception as e:
+                    logger.error(f"Error running OCR on {filepath} (page {page}): {str(e)}")
+                    results.append(None)
+            return results
+
+        logger.info(f"Running OCR on {len(args)} pages with {workers} workers")
+        results = []
+        outcomes = run_with_deadline(_ocr_job, args, workers, self.timeout, initializer=_init_worker)
+        for (filepath, page), (text, error) in zip(jobs, outcomes):
+            if isinstance(error, TimeoutError):
+                logger.error(f"Timed out running OCR on {filepath} (page {page}) after {self.timeout}s")
+            elif error is not None:
+                logger.error(f"Error running OCR on {filepath} (page {page}): {str(error)}")
+            results.append(text)
+        return results
+
+    def ocr_image_file(self, filepath):
+        """OCR a single image file in the calling process"""
+        return _ocr_job(filepath, None, self.dpi, self.cache_dir, self.lang)
@@ -0,0 +1,100 @@
+import os
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "int8", "int4")
+# Load mode for local chat models unless a caller picks one
+DEFAULT_QUANTIZATION = os.environ.get("MODEL_QUANTIZATION", "none")
+# Weights per int4 scale; smaller groups are more accurate and slightly larger
+INT4_GROUP_SIZE = 128
+
+
+def merge_adapters(model):
+    """
+    Fold LoRA adapters into the base weights, so quantization sees (and compresses) the fine-tuned weights
+
+    Raises:
+        RuntimeError: Adapter layers are still present after merging (e.g. a
+                      model with adapters injected by transformers' PEFT integration)
+    """
+    if hasattr(model, "merge_and_unload"):
+        logger.info("Merging LoRA adapters into the base weights")
+        model = model.merge_and_unload()
+    if any(hasattr(module, "lora_A") for module in model.modules()):
+        raise RuntimeError("LoRA adapter layers remain after merging; load the adapter with PeftModel.from_pretrained")
+    return model
+
+
+def quantize_model(model, mode=DEFAULT_QUANTIZATION, device="cpu"):
+    """
+    Quantize a loaded causal LM's linear layers for CPU inference
+
+    Modes:
+        none: Leave the weights as loaded
+        int8: torch dynamic quantization; int8 weights, activations quantized
+              per batch at run time (float32 models on CPU)
+        int4: torchao weight-only int4 with groupwise scales, computing in bfloat16;
+              needs the optional torchao package
+
+    LoRA adapters are merged before quantizing. Decoding on CPU is bound by
+    reading the weights, so int8 roughly halves and int4 roughly quarters the
+    memory traffic per token compared to float32.
+
+    Returns:
+        The quantized model, in eval mode
+    """
+    if mode in (None, "none"):
+        return model
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {QUANTIZATION_MODES}")
+    if device != "cpu":
+        logger.warning(f"{mode} quantization targets CPU inference; loading unquantized on {device}")
+        return model
+
+    model = merge_adapters(model)
+    model.eval()
+    if mode == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        try:
+            from torchao.quantization import quantize_, int4_weight_only
+        except ImportError:
+            raise ImportError("int4 quantization needs torchao: pip install torchao")
+        options = {"group_size": INT4_GROUP_SIZE}
+        try:
+            # Packed layout for the CPU int4 kernels (newer torchao)
+            from torchao.dtypes import Int4CPULayout
+            options["layout"] = Int4CPULayout()
+        except ImportError:
+            pass
+        model = model.to(torch.bfloat16)
+        quantize_(model, int4_weight_only(**options))
+    logger.info(f"Quantized model to {mode}")
+    return model
+
+
+def tensor_nbytes(tensor):
+    """
+    Bytes held by a tensor, including the inner tensors of wrapper subclasses
+    (torchao keeps packed int4 weights and their scales/zeros behind __tensor_flatten__)
+    """
+    if hasattr(tensor, "__tensor_flatten__"):
+        names, _ = tensor.__tensor_flatten__()
+        inner = (getattr(tensor, name) for name in names)
+        return sum(tensor_nbytes(item) for item in inner if isinstance(item, torch.Tensor))
+    return tensor.numel() * tensor.element_size()
+
+
+def model_size_mb(model):
+    """Memory held by a model's parameters and buffers, including packed quantized weights, in MB"""
+    state = model.state_dict()
+    total = 0
+    for value in state.values():
+        if isinstance(value, torch.Tensor):
+            total += tensor_nbytes(value)
+        elif isinstance(value, tuple):
+            # Dynamic quantized linears store (packed weight, bias)
+            total += sum(tensor_nbytes(item) for item in value if isinstance(item, torch.Tensor))
+    return total / 1e6
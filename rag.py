@@ -1,80 +1,123 @@
 import os
 import sys
-import pandas as pd
-from PIL import Image
-import pytesseract
-import docx2txt
-import PyPDF2
-import csv
-import openpyxl
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import TextLoader
 from langchain_community.docstore.document import Document
 from transformers import pipeline
 from tqdm import tqdm
+from registry import FileRegistry
+from embedding_cache import CachedEmbeddings
+from cache import LRUCache
+from vector_index import delete_from_store, ensure_index_type
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from mapped_store import (MANIFEST_FILE, has_vector_store, load_mapped_vector_store, load_vector_store, read_manifest,
+                          save_vector_store, store_directory)
+from metadata_filter import MetadataFilterIndex, search_positions
+from context_assembly import assemble_context
+from chunking import Chunker
+from ocr import OCREngine
+from extraction import FileExtractor, TABULAR_SEGMENTERS, extract_worker
+from doc_collections import collection_paths
+from rerank import Reranker
+from worker_pool import run_with_deadline
 import logging
 import hashlib
 import json
 import time
+import datetime
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class DocumentProcessor:
-    def __init__(self, directory_path):
-        logging.disable(logging.CRITICAL)  # Disable all logging
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Bumped whenever chunk boundaries or chunk metadata change; stores built with
+# another version (or another Chunker signature, e.g. after switching to an
+# embedding model with a different input length) are re-chunked once, including
+# stores saved before structure-aware chunking, which record no version at all
+CHUNK_VERSION = 2
+# Chunks embedded per vector store add, so indexing progress can be reported
+EMBEDDING_PROGRESS_BATCH = 512
+
+# Runs the dense and lexical halves of a hybrid search concurrently
+_search_pool = ThreadPoolExecutor(max_workers=8)
+
+class DocumentProcessor(FileExtractor):
+    def __init__(self, directory_path, embeddings=None, workers=None, file_timeout=300, progress=None):
+        super().__init__()
         self.directory_path = directory_path
-        # Initialize the embedding model
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        
-        # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        # Extraction pool size (defaults to all cores) and per-file time limit in seconds
+        self.workers = workers
+        self.file_timeout = file_timeout
+        # Scanned pages and images are OCRed on their own pool after extraction
+        self.ocr = OCREngine(workers=workers, timeout=file_timeout)
+        # Optional callback(stage, done, total) used to report indexing progress
+        self.progress = progress
+        # Initialize the embedding model (reuse a shared one if provided)
+        self.embeddings = embeddings if embeddings is not None else CachedEmbeddings(EMBEDDING_MODEL_NAME)
+        
+        # Per-format chunking sized in tokens of the embedding model
+        self.chunker = Chunker.from_embeddings(self.embeddings)
+        # Recorded in the store manifest; a mismatch forces every file to be re-chunked
+        self.chunk_version = f"{CHUNK_VERSION}/{self.chunker.signature()}"
         
         # Initialize document storage
         self.documents = []
         
-        # Initialize Tesseract for OCR (make sure tesseract is installed)
-        pytesseract.pytesseract.tesseract_cmd = r'tesseract'  # Update this path if needed
-        
-        # Track processed files for incremental updates
-        self.processed_files = {}
+        # Content-addressed registry of processed files (opened by process_directory)
+        self.registry = None
+        # Files that were new or changed in the last process_directory() call
+        self.changed_files = set()
+        # Files whose content is already in the registry; their text is loaded lazily
+        self.unchanged_files = []
+        # New or changed spreadsheets, written to the registry one row group at a
+        # time and read back from it the same way when chunking
+        self.streamed_files = []
+        # Whether the last create_vector_store() call added or removed any chunks
+        self.index_changed = False
+    
+    def report_progress(self, stage, done=0, total=0):
+        if self.progress is not None:
+            self.progress(stage, done, total)
         
     def load_file_registry(self, registry_path):
-        """Load the registry of processed files"""
-        if os.path.exists(registry_path):
-            try:
-                with open(registry_path, 'r') as f:
-                    self.processed_files = json.load(f)
-                logger.info(f"Loaded registry with {len(self.processed_files)} processed files")
-                return True
-            except Exception as e:
-                logger.error(f"Error loading file registry: {str(e)}")
-        return False
+        """
+        Open the SQLite registry of processed files, importing a legacy JSON registry on first use
+        
+        Args:
+            registry_path: Path to the registry database; a ".json" path is migrated
+                           to a ".db" file next to it
+        """
+        base, extension = os.path.splitext(registry_path)
+        db_path = base + ".db" if extension == ".json" else registry_path
+        legacy_path = base + ".json"
+        
+        self.registry = FileRegistry(db_path)
+        if len(self.registry) == 0 and os.path.exists(legacy_path):
+            self.registry.import_json(legacy_path)
+        logger.info(f"Loaded registry with {len(self.registry)} processed files")
+        return self.registry
     
-    def save_file_registry(self, registry_path):
-        """Save the registry of processed files"""
+    def get_file_stat_key(self, filepath):
+        """Cheap change check based on modified time and size"""
         try:
-            with open(registry_path, 'w') as f:
-                json.dump(self.processed_files, f)
-            logger.info(f"Saved registry with {len(self.processed_files)} processed files")
-            return True
+            file_stat = os.stat(filepath)
+            return f"{file_stat.st_mtime}_{file_stat.st_size}"
         except Exception as e:
-            logger.error(f"Error saving file registry: {str(e)}")
-            return False
+            logger.error(f"Error getting file stat for {filepath}: {str(e)}")
+            return None
             
     def get_file_hash(self, filepath):
-        """Get hash of file to detect changes"""
+        """Get a content hash of the file to detect changes"""
         try:
-            file_stat = os.stat(filepath)
-            # Use modified time and size as a quick hash
-            return f"{file_stat.st_mtime}_{file_stat.st_size}"
+            digest = hashlib.sha256()
+            with open(filepath, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            return digest.hexdigest()
         except Exception as e:
             logger.error(f"Error getting file hash for {filepath}: {str(e)}")
             return None
@@ -89,260 +132,550 @@ class DocumentProcessor:
         
         # Load registry of processed files
         self.load_file_registry(registry_path)
+        self.report_progress("scanning")
             
         file_count = 0
         new_files_count = 0
         updated_files_count = 0
+        seen_files = set()
         
-        for filename in tqdm(os.listdir(self.directory_path)):
+        # First pass: reuse unchanged files, queue new or changed ones for extraction
+        to_extract = []
+        for filename in os.listdir(self.directory_path):
             filepath = os.path.join(self.directory_path, filename)
             if os.path.isfile(filepath):
+                seen_files.add(filename)
                 try:
-                    # Get file hash to detect changes
-                    file_hash = self.get_file_hash(filepath)
+                    entry = self.registry.get(filename)
                     
-                    # Skip if file hasn't changed
-                    if filename in self.processed_files and self.processed_files[filename]["hash"] == file_hash:
-                        # Add the already processed content to documents list
-                        self.documents.append(Document(
-                            page_content=self.processed_files[filename]["content"], 
-                            metadata={"source": filename}
-                        ))
+                    # Skip if file hasn't changed: same stat, or same content after a copy/touch
+                    stat_key = self.get_file_stat_key(filepath)
+                    if entry is not None and entry["stat_key"] == stat_key:
+                        self.unchanged_files.append(filename)
                         file_count += 1
                         continue
                     
-                    # Process the file if it's new or changed
-                    file_extension = os.path.splitext(filename)[1].lower()
-                    text = self.extract_text(filepath, file_extension)
-                    
-                    if text:
-                        self.documents.append(Document(page_content=text, metadata={"source": filename}))
+                    file_hash = self.get_file_hash(filepath)
+                    if entry is not None and entry["content_hash"] == file_hash:
+                        self.registry.touch(filename, stat_key)
+                        self.unchanged_files.append(filename)
                         file_count += 1
-                        
-                        # Update the registry
-                        if filename in self.processed_files:
-                            updated_files_count += 1
-                        else:
-                            new_files_count += 1
-                            
-                        self.processed_files[filename] = {
-                            "hash": file_hash,
-                            "content": text,
-                            "processed_time": time.time()
+                        continue
+                    
+                    file_extension = os.path.splitext(filename)[1].lower()
+                    # Reuse the text of unchanged pages from the previous extraction
+                    page_cache = {}
+                    if entry is not None:
+                        page_cache = {
+                            segment["hash"]: segment["text"]
+                            for segment in self.registry.segments(filename)
+                            if segment.get("page") is not None and segment.get("hash")
                         }
+                    to_extract.append((filename, filepath, file_extension, (stat_key, file_hash, entry is not None), page_cache))
                 except Exception as e:
                     logger.error(f"Error processing {filename}: {str(e)}")
         
-        # Save the updated registry
-        self.save_file_registry(registry_path)
+        # Spreadsheets are streamed into the registry here, so no list of their
+        # row groups is ever built; chunking reads them back one batch at a time
+        streamed = [item for item in to_extract if item[2] in TABULAR_SEGMENTERS]
+        to_extract = [item for item in to_extract if item[2] not in TABULAR_SEGMENTERS]
+        for filename, filepath, file_extension, (stat_key, file_hash, known), _ in streamed:
+            try:
+                self.registry.put(filename, stat_key, file_hash, self.iter_tabular_segments(filepath, file_extension))
+            except Exception as e:
+                logger.error(f"Error extracting text from {filepath}: {str(e)}")
+                continue
+            if not self.registry.segment_count(filename):
+                self.registry.delete(filename)
+                continue
+            self.streamed_files.append(filename)
+            self.changed_files.add(filename)
+            file_count += 1
+            if known:
+                updated_files_count += 1
+            else:
+                new_files_count += 1
+        
+        # Second pass: extract the other files on the process pool and merge results in listing order
+        results = self.extract_files([(filepath, file_extension, page_cache) for _, filepath, file_extension, _, page_cache in to_extract])
+        self.run_ocr([filepath for _, filepath, _, _, _ in to_extract], results)
+        for (filename, filepath, file_extension, (stat_key, file_hash, known), _), segments in zip(to_extract, results):
+            if segments and any(segment["text"] for segment in segments):
+                self.documents.extend(self.segment_documents(filename, segments, self.get_upload_date(filepath)))
+                self.changed_files.add(filename)
+                file_count += 1
+                
+                # Update the registry, one file at a time
+                if known:
+                    updated_files_count += 1
+                else:
+                    new_files_count += 1
+                if any([segment.pop("ocr_failed", False) for segment in segments]):
+                    # Index what was read, but register the file without its stat key and
+                    # hash so the next refresh extracts it again and retries the failed pages
+                    logger.warning(f"OCR failed for part of {filename}; it will be retried on the next refresh")
+                    stat_key, file_hash = None, None
+                self.registry.put(filename, stat_key, file_hash, segments)
+        
+        # Forget files that were removed from the directory; their chunks are
+        # dropped from the vector store by create_vector_store()
+        deleted_files = [name for name in self.registry.names() if name not in seen_files]
+        for name in deleted_files:
+            self.registry.delete(name)
+        if deleted_files or updated_files_count:
+            self.registry.collect_garbage()
         
         logger.info(f"Successfully processed {file_count} files in total")
-        logger.info(f"New files: {new_files_count}, Updated files: {updated_files_count}")
+        logger.info(f"New files: {new_files_count}, Updated files: {updated_files_count}, Deleted files: {len(deleted_files)}")
         return True
     
-    def extract_text(self, filepath, file_extension):
-        """Extract text from different file types"""
-        logger.debug(f"Extracting text from {filepath} with extension {file_extension}")
-        
-        if file_extension in ['.txt']:
-            return self.extract_from_txt(filepath)
-        elif file_extension in ['.pdf']:
-            return self.extract_from_pdf(filepath)
-        elif file_extension in ['.docx', '.doc']:
-            return self.extract_from_docx(filepath)
-        elif file_extension in ['.csv']:
-            return self.extract_from_csv(filepath)
-        elif file_extension in ['.xlsx', '.xls']:
-            return self.extract_from_xlsx(filepath)
-        elif file_extension in ['.jpg', '.jpeg', '.png']:
-            return self.extract_from_image(filepath)
-        else:
-            logger.warning(f"Unsupported file type: {file_extension}")
-            return None
+    def extract_files(self, files):
+        """
+        Extract text from many files on a process pool
+
+        Each file gets file_timeout seconds from the moment a worker picks it
+        up; a worker that overruns is killed and replaced (see worker_pool).
+        This holds for a single file too, so one hung PDF can never block a
+        refresh. Files are only extracted in this process when file_timeout
+        is None or 0.
+        
+        Args:
+            files: List of (filepath, file_extension, page_cache) tuples
+            
+        Returns:
+            list: Extracted segments per file, in the same order as files; None for
+                  files that failed or exceeded file_timeout
+        """
+        workers = max(1, min(self.workers or os.cpu_count() or 1, len(files)))
+        results = []
+        self.report_progress("extracting", 0, len(files))
+        if not self.file_timeout:
+            # Without a time limit there is nothing a worker process would protect against
+            for args in tqdm(files):
+                results.append(self.extract_segments(*args))
+                self.report_progress("extracting", len(results), len(files))
+            return results
+        
+        logger.info(f"Extracting {len(files)} files with {workers} workers")
+        outcomes = run_with_deadline(
+            extract_worker, files, workers, self.file_timeout,
+            progress=lambda done: self.report_progress("extracting", done, len(files))
+        )
+        for (filepath, _, _), (segments, error) in zip(files, outcomes):
+            if isinstance(error, TimeoutError):
+                logger.error(f"Timed out extracting text from {filepath} after {self.file_timeout}s")
+            elif error is not None:
+                logger.error(f"Error extracting text from {filepath}: {str(error)}")
+            results.append(segments)
+        return results
     
-    # All the extraction methods remain the same
-    def extract_from_txt(self, filepath):
-        # Same implementation as before
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
-                return file.read()
-        except Exception as e:
-            logger.error(f"Error extracting text from {filepath}: {str(e)}")
-            return ""
+    def run_ocr(self, filepaths, results):
+        """
+        Fill in the text of segments flagged for OCR, in place
+        
+        Extraction workers can't start pools of their own, so scanned PDF pages
+        and images are collected here and OCRed together on one pool.
+        
+        Args:
+            filepaths: File path of each extraction result
+            results: Segment lists from extract_files (None for failed files)
+        """
+        jobs = []
+        targets = []
+        for filepath, segments in zip(filepaths, results):
+            for segment in segments or []:
+                if segment.pop("ocr", False):
+                    jobs.append((filepath, segment["page"]))
+                    targets.append((filepath, segment))
+        if not jobs:
+            return
+        
+        self.report_progress("ocr", 0, len(jobs))
+        for (filepath, segment), text in zip(targets, self.ocr.run(jobs)):
+            if text is None:
+                # Timed out or failed: not the same as a page without text. The
+                # segment gets no hash, so it is never reused from the page cache
+                segment.update({"text": "", "hash": None, "ocr_failed": True})
+                continue
+            if segment["page"] is None:
+                # Image files: one segment, hashed by its text like other whole files
+                if not text.strip():
+                    text = f"Image file without extractable text: {os.path.basename(filepath)}"
+                segment["hash"] = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            segment["text"] = text
+        self.report_progress("ocr", len(jobs), len(jobs))
     
-    def extract_from_pdf(self, filepath):
-        # Same implementation as before
+    @staticmethod
+    def get_upload_date(filepath):
+        """ISO date a file was written to the documents folder"""
         try:
-            text = ""
-            with open(filepath, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from PDF {filepath}: {str(e)}")
-            return ""
+            return datetime.date.fromtimestamp(os.path.getmtime(filepath)).isoformat()
+        except OSError:
+            return None
     
-    # Other extraction methods remain the same...
-    def extract_from_docx(self, filepath):
-        try:
-            return docx2txt.process(filepath)
-        except Exception as e:
-            logger.error(f"Error extracting text from DOCX {filepath}: {str(e)}")
-            return ""
+    @staticmethod
+    def segment_documents(filename, segments, uploaded=None, count=None):
+        """
+        Yield one Document per non-empty segment, tagged with its source, file type, upload date and page (or row group)
+
+        segments may be a generator when count, the number of segments, is given.
+        """
+        file_type = os.path.splitext(filename)[1].lower().lstrip(".")
+        count = len(segments) if count is None else count
+        for position, segment in enumerate(segments):
+            if not segment["text"]:
+                continue
+            metadata = {"source": filename, "file_type": file_type}
+            if uploaded is not None:
+                metadata["uploaded"] = uploaded
+            if segment.get("page") is not None:
+                metadata["page"] = segment["page"]
+            elif count > 1:
+                # Row groups of a spreadsheet; keeps their chunk indexes apart
+                metadata["segment"] = position
+            yield Document(page_content=segment["text"], metadata=metadata)
     
-    def extract_from_csv(self, filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
-                csv_reader = csv.reader(file)
-                rows = list(csv_reader)
-                
-                # Convert CSV to a readable text format
-                headers = rows[0] if rows else []
-                text = "CSV File Content:\n"
-                
-                # Add headers
-                text += "Headers: " + ", ".join(headers) + "\n\n"
-                
-                # Add data rows
-                for i, row in enumerate(rows[1:], start=1):
-                    row_text = f"Row {i}: "
-                    for j, cell in enumerate(row):
-                        if j < len(headers):
-                            row_text += f"{headers[j]}: {cell}, "
-                    text += row_text + "\n"
-                    
-                return text
-        except Exception as e:
-            logger.error(f"Error extracting text from CSV {filepath}: {str(e)}")
-            return ""
+    @staticmethod
+    def get_chunk_id(source, chunk, content, page=None, segment=None):
+        """Stable chunk identity derived from (source, page or segment, chunk index, content hash)"""
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        identity = source if page is None else f"{source}|p{page}"
+        if segment is not None:
+            identity = f"{identity}|s{segment}"
+        return hashlib.sha1(f"{identity}|{chunk}|{content_hash}|v{CHUNK_VERSION}".encode("utf-8")).hexdigest()
     
-    def extract_from_xlsx(self, filepath):
-        try:
-            workbook = openpyxl.load_workbook(filepath, data_only=True)
-            text = f"Excel File: {os.path.basename(filepath)}\n\n"
-            
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
-                
-                # Get all values from the sheet
-                data = []
-                for row in sheet.iter_rows(values_only=True):
-                    data.append(row)
-                
-                if not data:
-                    text += "Empty sheet\n\n"
-                    continue
-                    
-                # Extract headers (first row)
-                headers = [str(cell) if cell is not None else "" for cell in data[0]]
-                
-                # Process data rows
-                for i, row in enumerate(data[1:], start=2):
-                    row_text = f"Row {i-1}: "
-                    for j, cell in enumerate(row):
-                        if j < len(headers) and headers[j]:
-                            row_text += f"{headers[j]}: {str(cell) if cell is not None else 'N/A'}, "
-                    text += row_text + "\n"
-                
-                text += "\n"
-            
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from Excel {filepath}: {str(e)}")
-            return ""
+    def chunk_document(self, doc):
+        """Split a document (a whole file or a single page) into chunks tagged with their chunk index and chunk id"""
+        chunked_docs = []
+        file_extension = os.path.splitext(doc.metadata.get("source", ""))[1].lower()
+        for i, chunk in enumerate(self.chunker.split(doc.page_content, file_extension)):
+            metadata = doc.metadata.copy()
+            metadata["chunk"] = i
+            metadata["chunk_id"] = self.get_chunk_id(metadata.get("source"), i, chunk, metadata.get("page"), metadata.get("segment"))
+            chunked_docs.append(Document(page_content=chunk, metadata=metadata))
+        return chunked_docs
     
-    def extract_from_image(self, filepath):
-        try:
-            img = Image.open(filepath)
-            text = pytesseract.image_to_string(img)
-            if not text:
-                return f"Image file without extractable text: {os.path.basename(filepath)}"
-            return text
-        except Exception as e:
-            logger.error(f"Error extracting text from image {filepath}: {str(e)}")
-            return ""
+    def iter_documents(self, existing_ids, wanted_ids, reuse_chunks=True):
+        """
+        Yield the documents that need chunking
+        
+        Changed files are always yielded. Unchanged files whose chunks are all in
+        existing_ids are skipped (their ids go into wanted_ids) without reading
+        their text, unless reuse_chunks is False; otherwise their segments are
+        loaded from the registry.
+        """
+        for filename in self.unchanged_files:
+            entry = self.registry.get(filename)
+            known_ids = entry["chunk_ids"] if entry else None
+            if reuse_chunks and known_ids and existing_ids.issuperset(known_ids):
+                wanted_ids.update(known_ids)
+                continue
+            yield from self.registry_documents(filename)
+        for filename in self.streamed_files:
+            yield from self.registry_documents(filename)
+        yield from self.documents
+    
+    def registry_documents(self, filename):
+        """Stream the documents of a file from its segments in the registry"""
+        uploaded = self.get_upload_date(os.path.join(self.directory_path, filename))
+        return self.segment_documents(filename, self.registry.iter_segments(filename), uploaded,
+                                      count=self.registry.segment_count(filename))
     
-    def create_vector_store(self, save_path=None, update_existing=False):
-        """Create or update a vector store from chunked documents"""
-        if not self.documents:
+    def create_vector_store(self, save_path=None, update_existing=False, index_type="auto"):
+        """
+        Create or incrementally update a vector store from chunked documents.
+        
+        Every chunk is stored under its chunk id, so an update only embeds chunks
+        whose id is not in the store yet and deletes ids that no longer belong to
+        any file (modified or deleted files). Unchanged chunks are never touched.
+        
+        Args:
+            save_path: Directory to load/save the vector store
+            update_existing: Whether to update the store in save_path instead of creating one
+            index_type: FAISS index type ("flat", "ivf_flat", "hnsw", "ivf_pq"), or
+                        "auto" to pick one from the corpus size; the index is rebuilt
+                        from cached embeddings when the target type changes
+        """
+        vector_store = None
+        if update_existing and save_path and has_vector_store(save_path):
+            # Diff against the memory-mapped store; a writable copy is only loaded if something changes
+            logger.info(f"Opening existing vector store in {save_path}")
+            vector_store = load_mapped_vector_store(save_path, self.embeddings)
+        
+        existing_ids = set(vector_store.index_to_docstore_id.values()) if vector_store is not None else set()
+        # Chunks of an older chunk version are rebuilt even for unchanged files
+        reuse_chunks = vector_store is not None and read_manifest(save_path).get("chunk_version") == self.chunk_version
+        if vector_store is not None and not reuse_chunks:
+            logger.info(f"Stored chunks were built with other chunking rules; re-chunking every file ({self.chunk_version})")
+        
+        if not self.documents and not self.streamed_files and not self.unchanged_files and not existing_ids:
             logger.warning("No documents to process.")
             return None
             
         logger.info("Chunking documents...")
-        chunked_docs = []
+        self.report_progress("chunking")
+        wanted_ids = set()
+        file_chunk_ids = {}
+        # New chunks are embedded in batches as they are produced, so memory is
+        # bounded by one batch rather than by the size of the changed files
+        pending = []
+        added = 0
+        writable = False
         
-        for doc in tqdm(self.documents):
-            chunks = self.text_splitter.split_text(doc.page_content)
-            for i, chunk in enumerate(chunks):
-                metadata = doc.metadata.copy()
-                metadata["chunk"] = i
-                chunked_docs.append(Document(page_content=chunk, metadata=metadata))
+        def flush():
+            # The writable store is created or loaded on the first batch that needs it
+            nonlocal vector_store, writable, added
+            if not pending:
+                return
+            ids = [chunk.metadata["chunk_id"] for chunk in pending]
+            if vector_store is None:
+                logger.info("Creating new vector store...")
+                vector_store = FAISS.from_documents(pending, self.embeddings, ids=ids)
+            else:
+                if not writable:
+                    logger.info(f"Loading writable vector store from {save_path}")
+                    vector_store = load_vector_store(save_path, self.embeddings)
+                vector_store.add_documents(pending, ids=ids)
+            writable = True
+            added += len(pending)
+            pending.clear()
+            self.report_progress("embedding", added, added)
         
-        logger.info(f"Created {len(chunked_docs)} chunks from {len(self.documents)} documents")
+        # Documents are pages (PDFs), row groups (spreadsheets) or whole files, fed to the splitter one at a time
+        for doc in tqdm(self.iter_documents(existing_ids, wanted_ids, reuse_chunks)):
+            source = doc.metadata.get("source")
+            chunks = self.chunk_document(doc)
+            file_chunk_ids.setdefault(source, []).extend(chunk.metadata["chunk_id"] for chunk in chunks)
+            for chunk in chunks:
+                chunk_id = chunk.metadata["chunk_id"]
+                if chunk_id not in existing_ids and chunk_id not in wanted_ids:
+                    pending.append(chunk)
+                wanted_ids.add(chunk_id)
+            if len(pending) >= EMBEDDING_PROGRESS_BATCH:
+                flush()
+        flush()
         
-        if not chunked_docs:
+        for source, chunk_ids in file_chunk_ids.items():
+            self.registry.set_chunk_ids(source, chunk_ids)
+        
+        stale_ids = list(existing_ids - wanted_ids)
+        logger.info(f"{added} chunks added, {len(stale_ids)} chunks to remove, {len(wanted_ids)} chunks in total")
+        
+        if vector_store is None:
             logger.warning("No chunks created.")
             return None
-            
-        # Create or update vector store
-        if update_existing and save_path and os.path.exists(os.path.join(save_path, "index.faiss")):
-            logger.info(f"Loading existing vector store from {save_path}")
-            vector_store = FAISS.load_local(save_path, self.embeddings, allow_dangerous_deserialization=True)
-            
-            # Add new documents to existing vector store
-            if chunked_docs:
-                logger.info(f"Updating vector store with {len(chunked_docs)} new chunks")
-                vector_store.add_documents(chunked_docs)
-                # Save the updated vector store
-                vector_store.save_local(save_path)
-        else:
-            logger.info("Creating new vector store...")
-            vector_store = FAISS.from_documents(chunked_docs, self.embeddings)
-            
-            # Save the vector store if a path is provided
-            if save_path:
-                logger.info(f"Saving vector store to {save_path}")
-                vector_store.save_local(save_path)
+        if stale_ids:
+            if not writable:
+                logger.info(f"Loading writable vector store from {save_path}")
+                vector_store = load_vector_store(save_path, self.embeddings)
+            vector_store = delete_from_store(vector_store, stale_ids, self.embeddings)
+        if not stale_ids and not added:
+            vector_store, rebuilt = ensure_index_type(vector_store, index_type, self.embeddings)
+            if not rebuilt:
+                logger.info("Vector store is up to date")
+                return vector_store
+        self.index_changed = True
+        
+        vector_store, _ = ensure_index_type(vector_store, index_type, self.embeddings)
+        
+        # Save the vector store
+        if save_path:
+            logger.info(f"Saving vector store to {save_path}")
+            self.report_progress("saving")
+            save_vector_store(vector_store, save_path, chunk_version=self.chunk_version)
         
         return vector_store
 
 class RAGSystem:
-    def __init__(self, vector_store=None, vector_store_path=None):
-        """Initialize the RAG system"""
+    def __init__(self, vector_store=None, vector_store_path=None, embeddings=None,
+                 index_version=0, query_cache=None, result_cache=None, cache_size=256,
+                 lexical_index=None, hybrid=True, reranker=None, rerank_candidates=20):
+        """
+        Initialize the RAG system
+        
+        Args:
+            vector_store: An already loaded vector store
+            vector_store_path: Path to load the vector store from if none is given
+            embeddings: Embedding model for queries (defaults to the store's own)
+            index_version: Version of the index, part of every result cache key
+            query_cache: LRUCache of query embeddings, shared across index versions
+            result_cache: LRUCache of top-k results
+            cache_size: Size of the caches created when none are passed in
+            lexical_index: LexicalIndex holding the same chunks as the vector store
+            hybrid: Fuse BM25 and vector results when a lexical index is available
+            reranker: Optional Reranker applied to a larger candidate pool
+            rerank_candidates: Number of candidates retrieved for the reranker
+        """
         if vector_store:
             self.vector_store = vector_store
-        elif vector_store_path and os.path.exists(os.path.join(vector_store_path, "index.faiss")):
-            self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-            self.vector_store = FAISS.load_local(vector_store_path, self.embeddings, allow_dangerous_deserialization=True)
+            self.embeddings = embeddings if embeddings is not None else vector_store.embeddings
+        elif vector_store_path and has_vector_store(vector_store_path):
+            self.embeddings = embeddings if embeddings is not None else CachedEmbeddings(EMBEDDING_MODEL_NAME)
+            self.vector_store = load_mapped_vector_store(vector_store_path, self.embeddings)
         else:
             raise ValueError("Either vector_store or a valid vector_store_path must be provided")
+        
+        self.index_version = index_version
+        self.query_cache = query_cache if query_cache is not None else LRUCache(cache_size)
+        self.result_cache = result_cache if result_cache is not None else LRUCache(cache_size)
+        self.lexical_index = lexical_index
+        self.hybrid = hybrid and lexical_index is not None
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        # Per-query timings of the retrieval stages (most recent last)
+        self.timings = deque(maxlen=1000)
+        # Metadata value -> positions index, saved with mapped stores and built on demand otherwise
+        self.filter_index = getattr(self.vector_store, "filter_index", None)
     
-    def query(self, prompt, k=5):
+    def embed_query(self, prompt):
+        """Embed a prompt, reusing the embedding of an identical (whitespace-normalized) prompt"""
+        key = " ".join(prompt.split())
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(prompt)
+            self.query_cache.put(key, embedding)
+        return embedding
+    
+    def filter_positions(self, filter):
+        """FAISS positions matching a metadata filter, or None for no filter"""
+        if not filter:
+            return None
+        if self.filter_index is None:
+            self.filter_index = MetadataFilterIndex.from_vector_store(self.vector_store)
+        return self.filter_index.positions(filter)
+    
+    def retrieve(self, prompt, k=5, filter=None, rerank=None):
+        """
+        Top-k documents for a prompt, cached per index version
+        
+        Args:
+            prompt: The user's prompt/question
+            k: Number of documents to return
+            filter: Optional metadata filter, e.g. {"source": "case.pdf", "page": {"gte": 3}};
+                    see MetadataFilterIndex for the syntax
+            rerank: Rerank the candidates with the cross-encoder; by default whenever
+                    a reranker is set
+        """
+        reranker = self.reranker if rerank is None or rerank else None
+        if rerank and reranker is None:
+            raise ValueError("rerank=True needs a RAGSystem with a reranker")
+        filter_key = json.dumps(filter, sort_keys=True, default=str) if filter else None
+        key = (self.index_version, " ".join(prompt.split()), k, filter_key, reranker is not None)
+        retrieved_docs = self.result_cache.get(key)
+        if retrieved_docs is None:
+            start = time.perf_counter()
+            # Resolved before scoring, so only matching chunks are ever searched
+            positions = self.filter_positions(filter)
+            fetch_k = max(k, self.rerank_candidates) if reranker is not None else k
+            if positions is not None and len(positions) == 0:
+                retrieved_docs = []
+            elif self.hybrid:
+                retrieved_docs = self.hybrid_search(prompt, k=fetch_k, positions=positions)
+            else:
+                retrieved_docs = self.dense_search(prompt, k=fetch_k, positions=positions)
+            timing = {"retrieve_ms": (time.perf_counter() - start) * 1000}
+
+            if reranker is not None:
+                retrieved_docs, rerank_timing = reranker.rerank(prompt, retrieved_docs, k=k)
+                timing.update(rerank_timing)
+            self.timings.append(timing)
+            self.result_cache.put(key, retrieved_docs)
+        return retrieved_docs
+    
+    def timing_stats(self):
+        """p50/p95 latency in milliseconds of each retrieval stage over recent uncached queries"""
+        timings = list(self.timings)
+        stats = {"queries": len(timings)}
+        for stage in ("retrieve_ms", "rerank_ms"):
+            values = sorted(timing[stage] for timing in timings if stage in timing)
+            if values:
+                stats[stage] = {
+                    "p50": values[len(values) // 2],
+                    "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+                }
+        return stats
+    
+    def dense_search(self, prompt, k=5, positions=None):
+        """Vector similarity search, restricted to the given FAISS positions if any"""
+        if positions is None:
+            return self.vector_store.similarity_search_by_vector(self.embed_query(prompt), k=k)
+        _, found = search_positions(self.vector_store.index, self.embed_query(prompt), positions, k)
+        docs = []
+        for position in found:
+            doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[position])
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
+    
+    def hybrid_search(self, prompt, k=5, fetch_k=None, positions=None):
+        """
+        Run BM25 and vector search concurrently and fuse them with reciprocal rank fusion
+        
+        Args:
+            prompt: The user's prompt/question
+            k: Number of documents to return
+            fetch_k: Candidates taken from each retriever (defaults to 2 * k)
+            positions: Optional FAISS positions both retrievers are restricted to
+        """
+        fetch_k = fetch_k or max(2 * k, 10)
+        allowed_ids = None
+        if positions is not None:
+            allowed_ids = {self.vector_store.index_to_docstore_id[int(position)] for position in positions}
+        dense_future = _search_pool.submit(self.dense_search, prompt, fetch_k, positions)
+        lexical_future = _search_pool.submit(self.lexical_index.search, prompt, fetch_k, allowed_ids)
+        dense_docs = dense_future.result()
+        lexical_hits = lexical_future.result()
+        
+        docs_by_id = {doc.metadata.get("chunk_id"): doc for doc in dense_docs}
+        fused_ids = reciprocal_rank_fusion([
+            list(docs_by_id),
+            [chunk_id for chunk_id, _ in lexical_hits]
+        ])
+        
+        retrieved_docs = []
+        for chunk_id in fused_ids:
+            doc = docs_by_id.get(chunk_id) or self.vector_store.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                retrieved_docs.append(doc)
+            if len(retrieved_docs) == k:
+                break
+        return retrieved_docs
+    
+    def cache_stats(self):
+        """Hit/miss counters of the query embedding and result caches"""
+        return {
+            "index_version": self.index_version,
+            "query_embeddings": self.query_cache.stats(),
+            "results": self.result_cache.stats()
+        }
+    
+    def query(self, prompt, k=5, token_budget=None, tokenizer=None, filter=None, rerank=None):
         """
         Query the vector store and return the prompt enriched with relevant information
         
         Args:
             prompt: The user's prompt/question
             k: Number of relevant chunks to retrieve
+            token_budget: Maximum number of context tokens, or None for no limit
+            tokenizer: Tokenizer of the generating model, used to measure the budget
+            filter: Optional metadata filter on source, file_type, uploaded or page
+            rerank: Rerank the candidates with the cross-encoder (see retrieve)
             
         Returns:
             Enriched prompt with relevant context
         """
         # Retrieve relevant documents
-        retrieved_docs = self.vector_store.similarity_search(prompt, k=k)
+        retrieved_docs = self.retrieve(prompt, k=k, filter=filter, rerank=rerank)
         
-        # Extract relevant context
-        context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+        # Merge overlapping chunks, drop near-duplicates and pack into the token budget
+        context, used_docs = assemble_context(retrieved_docs, token_budget=token_budget, tokenizer=tokenizer)
         
         # Create sources list for citation
         sources = []
-        for doc in retrieved_docs:
+        for doc in used_docs:
             source = doc.metadata.get("source", "Unknown")
+            if doc.metadata.get("page") is not None:
+                source = f"{source} (p. {doc.metadata['page']})"
             if source not in sources:
                 sources.append(source)
         
@@ -365,38 +698,413 @@ class RAGSystem:
                 
         return context
 
+
+# Refresh locks per vector store path, shared by every engine that ever used the
+# path: an evicted engine may still be refreshing when its replacement starts
+_store_locks = {}
+_store_locks_lock = threading.Lock()
+
+def _store_lock(vector_store_path):
+    """The process-wide lock serializing refreshes of one vector store"""
+    with _store_locks_lock:
+        return _store_locks.setdefault(os.path.abspath(vector_store_path), threading.Lock())
+
+def _manifest_stamp(vector_store_path):
+    """(mtime, size) of a saved vector store's manifest, or None if there is none"""
+    try:
+        stat = os.stat(os.path.join(vector_store_path, MANIFEST_FILE))
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class RAGEngine:
+    """
+    Long-lived RAG service that keeps the embedding model and vector store in memory.
+
+    The embedder and FAISS index are loaded once and every query() is answered from
+    memory. Documents on disk are only re-scanned when refresh() is called, either
+    explicitly or by a watcher (see indexer.BackgroundIndexer). With
+    initial_refresh=False the engine starts empty and leaves the first scan to the watcher.
+    """
+    def __init__(self, directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.db",
+                 workers=None, file_timeout=300, embedding_batch_size=64, embedding_threads=None, cache_size=256,
+                 index_type="auto", hybrid=True, rerank=False, rerank_candidates=20, initial_refresh=True,
+                 embeddings=None):
+        self.directory_path = directory_path
+        self.vector_store_path = vector_store_path
+        self.file_registry_path = file_registry_path
+        self.workers = workers
+        self.file_timeout = file_timeout
+        self.index_type = index_type
+        self.hybrid = hybrid
+        # BM25 inverted index kept next to the FAISS files
+        self.lexical_index = None
+        # Optional cross-encoder stage; with it a smaller final k gives the same quality.
+        # rerank sets the default per query; the model is loaded on first use either way
+        self.rerank = rerank
+        self.reranker = Reranker() if rerank else None
+        self.rerank_candidates = rerank_candidates
+        self._reranker_lock = threading.Lock()
+
+        # Load the embedding model once for the lifetime of the engine (or share one
+        # between engines); chunk embeddings are cached on disk, so rebuilding the
+        # index only costs a FAISS add
+        self.embeddings = embeddings if embeddings is not None else CachedEmbeddings(
+            EMBEDDING_MODEL_NAME,
+            batch_size=embedding_batch_size,
+            num_threads=embedding_threads
+        )
+
+        # Query embeddings survive refreshes; results are keyed by index version,
+        # which is bumped every time an ingest changes the index
+        self.index_version = 0
+        self.query_cache = LRUCache(cache_size)
+        self.result_cache = LRUCache(cache_size)
+
+        self.rag_system = None
+        self.last_refresh = None
+        # Set once the engine is evicted; a closed engine is never refreshed again
+        self.closed = False
+        # Serializes refreshes of this store across engines; queries never wait on it
+        self._refresh_lock = _store_lock(vector_store_path)
+        # Guards swapping in a new RAG system, which load() may do during a refresh
+        self._open_lock = threading.Lock()
+        # (mtime, size) of the manifest behind rag_system, to notice stores saved elsewhere
+        self.store_stamp = None
+
+        if initial_refresh:
+            self.refresh()
+
+    def refresh(self, progress=None):
+        """
+        Re-scan the documents folder and update the vector store.
+
+        The new RAG system is built on the side and swapped in with a single
+        assignment, so concurrent queries keep using the previous one until then.
+
+        Args:
+            progress: Optional callback(stage, done, total) reporting indexing progress
+
+        Returns:
+            bool: True if a vector store is available after the refresh
+        """
+        with self._refresh_lock:
+            if self.closed:
+                return False
+            vector_store_exists = has_vector_store(self.vector_store_path)
+
+            processor = DocumentProcessor(
+                self.directory_path,
+                embeddings=self.embeddings,
+                workers=self.workers,
+                file_timeout=self.file_timeout,
+                progress=progress
+            )
+            processor.process_directory(self.file_registry_path)
+            vector_store = processor.create_vector_store(
+                save_path=self.vector_store_path,
+                update_existing=vector_store_exists,
+                index_type=self.index_type
+            )
+
+            if vector_store is not None:
+                with self._open_lock:
+                    lexical_reopened = self._open_lexical_index()
+                    if self.lexical_index is not None:
+                        self.lexical_index.sync(vector_store)
+                    if processor.index_changed or lexical_reopened or self.rag_system is None:
+                        self._open_store()
+            self.last_refresh = time.time()
+            return self.rag_system is not None
+
+    def load(self):
+        """
+        Open the vector store last saved at vector_store_path, without scanning the documents
+
+        Used on the query path: it costs one stat() when nothing changed, and
+        picks up a store rebuilt by a refresh in this or another process
+        (e.g. the serving app's background indexer).
+
+        Returns:
+            bool: True if a vector store is available
+        """
+        stamp = _manifest_stamp(self.vector_store_path)
+        if stamp is None or stamp == self.store_stamp or self.closed:
+            return self.rag_system is not None
+        with self._open_lock:
+            if stamp != self.store_stamp and not self.closed:
+                self._open_lexical_index()
+                self._open_store()
+        return self.rag_system is not None
+
+    def _open_lexical_index(self):
+        """Open the BM25 index of a hybrid engine if needed; True if it was (re)opened"""
+        # Reopen if the vector store directory was reset underneath us
+        if not self.hybrid or (self.lexical_index is not None and os.path.exists(self.lexical_index.path)):
+            return False
+        self.lexical_index = LexicalIndex(os.path.join(self.vector_store_path, "lexical.db"))
+        return True
+
+    def _open_store(self):
+        """Swap in a RAG system over the saved vector store; call with _open_lock held"""
+        self.store_stamp = _manifest_stamp(self.vector_store_path)
+        self.index_version += 1
+        # Queries run against the memory-mapped copy that was just saved,
+        # sharing its pages with every other process using this store
+        self.rag_system = RAGSystem(
+            vector_store=load_mapped_vector_store(self.vector_store_path, self.embeddings),
+            embeddings=self.embeddings,
+            index_version=self.index_version,
+            query_cache=self.query_cache,
+            result_cache=self.result_cache,
+            lexical_index=self.lexical_index,
+            hybrid=self.hybrid,
+            reranker=self.reranker,
+            rerank_candidates=self.rerank_candidates
+        )
+        # Results of older versions can never be hit again
+        self.result_cache.clear()
+
+    def get_reranker(self):
+        """The engine's cross-encoder, loaded on first use"""
+        with self._reranker_lock:
+            if self.reranker is None:
+                self.reranker = Reranker()
+            return self.reranker
+
+    def query(self, prompt, k=None, token_budget=None, tokenizer=None, filter=None, rerank=None):
+        """
+        Retrieve context for a prompt from the in-memory vector store
+
+        Args:
+            prompt: The user's prompt/question
+            k: Number of relevant chunks to retrieve (3 with reranking, 5 without, by default)
+            token_budget: Maximum number of context tokens, or None for no limit
+            tokenizer: Tokenizer of the generating model, used to measure the budget
+            filter: Optional metadata filter on source, file_type, uploaded or page
+            rerank: Rerank the candidates with the cross-encoder; defaults to the engine's setting
+
+        Returns:
+            Relevant context, or an empty string if nothing has been indexed
+        """
+        rag_system = self.rag_system
+        if rag_system is None:
+            logger.warning("RAG engine has no vector store; returning empty context")
+            return ""
+        rerank = self.rerank if rerank is None else rerank
+        if rerank and rag_system.reranker is None:
+            rag_system.reranker = self.get_reranker()
+        return rag_system.query(prompt, k=k or (3 if rerank else 5), token_budget=token_budget, tokenizer=tokenizer,
+                                filter=filter, rerank=rerank)
+
+    def cache_stats(self):
+        """Hit/miss counters of the retrieval caches"""
+        rag_system = self.rag_system
+        if rag_system is None:
+            return {"index_version": self.index_version}
+        stats = rag_system.cache_stats()
+        if self.reranker is not None:
+            stats["rerank_scores"] = self.reranker.score_cache.stats()
+        return stats
+
+    def timing_stats(self):
+        """Latency of the retrieval and rerank stages"""
+        rag_system = self.rag_system
+        return rag_system.timing_stats() if rag_system is not None else {"queries": 0}
+
+    def memory_usage(self):
+        """
+        Bytes this engine can pin in memory: the size of its memory-mapped vector
+        store (current version) and lexical index files (an upper bound on their
+        resident pages)
+        """
+        if self.rag_system is None or not os.path.isdir(self.vector_store_path):
+            return 0
+        total = 0
+        try:
+            for directory in {self.vector_store_path, store_directory(self.vector_store_path)}:
+                for entry in os.scandir(directory):
+                    if entry.is_file():
+                        total += entry.stat().st_size
+        except FileNotFoundError:
+            # The store was reset underneath us
+            pass
+        return total
+
+    def close(self):
+        """Drop the loaded index so its mapped pages and connections can be released"""
+        with self._refresh_lock:
+            self.closed = True
+            self.rag_system = None
+            if self.lexical_index is not None:
+                self.lexical_index.close()
+                self.lexical_index = None
+            self.result_cache.clear()
+
+
+# Loaded engines are evicted least recently used first once their indexes exceed this
+ENGINE_MEMORY_CAP = int(os.environ.get("RAG_ENGINE_MEMORY_CAP_MB", "2048")) * 1024 * 1024
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    return value.strip().lower() in ("1", "true", "yes", "on") if value else default
+
+# RAGEngine settings of every shared engine, set per process from the environment
+# (get_engine(**options) overrides them for one engine)
+ENGINE_OPTIONS = {
+    "workers": _env_int("RAG_WORKERS"),
+    "file_timeout": _env_int("RAG_FILE_TIMEOUT", 300),
+    "embedding_batch_size": _env_int("RAG_EMBEDDING_BATCH_SIZE", 64),
+    "embedding_threads": _env_int("RAG_EMBEDDING_THREADS"),
+    "cache_size": _env_int("RAG_CACHE_SIZE", 256),
+    "index_type": os.environ.get("RAG_INDEX_TYPE", "auto"),
+    "hybrid": _env_flag("RAG_HYBRID", True),
+    "rerank": _env_flag("RAG_RERANK", False),
+    "rerank_candidates": _env_int("RAG_RERANK_CANDIDATES", 20),
+}
+
+# Process-wide engines, keyed by their paths, least recently used first
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+# Per-key locks held while an engine is being built, so only one thread builds each
+_engines_loading = {}
+# Engines that must stay loaded (e.g. watched by a background indexer)
+_pinned_engines = set()
+# One embedding model shared by every engine
+_shared_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_shared_embeddings(batch_size=64, num_threads=None):
+    """The embedding model shared by every engine in this process, loaded (with these settings) on first use"""
+    global _shared_embeddings
+    with _embeddings_lock:
+        if _shared_embeddings is None:
+            _shared_embeddings = CachedEmbeddings(EMBEDDING_MODEL_NAME, batch_size=batch_size, num_threads=num_threads)
+        return _shared_embeddings
+
+def get_engine(directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.db",
+               initial_refresh=True, pin=False, **options):
+    """
+    Return the shared RAGEngine for the given paths, creating it on first use
+
+    Engines are kept in LRU order; loading one evicts the least recently used
+    others while the loaded indexes exceed ENGINE_MEMORY_CAP. A new engine is
+    built (and indexed) outside the global lock, so loading one collection
+    never blocks queries against the others.
+
+    Args:
+        directory_path: Path to the directory containing documents
+        vector_store_path: Path to save/load the vector store
+        file_registry_path: Path to save/load the file registry
+        initial_refresh: Index the documents before returning a newly created engine
+        pin: Never evict this engine
+        **options: RAGEngine settings overriding ENGINE_OPTIONS (workers, file_timeout,
+                   embedding_batch_size, embedding_threads, cache_size, index_type,
+                   hybrid, rerank, rerank_candidates); they only apply when this call
+                   creates the engine
+
+    Returns:
+        RAGEngine: The process-wide engine for these paths
+    """
+    key = (directory_path, vector_store_path, file_registry_path)
+    with _engines_lock:
+        if pin:
+            _pinned_engines.add(key)
+        if key in _engines:
+            _engines.move_to_end(key)
+            return _engines[key]
+        loading = _engines_loading.setdefault(key, threading.Lock())
+
+    # Callers asking for the same engine wait here for the first one to build it
+    with loading:
+        with _engines_lock:
+            if key in _engines:
+                _engines.move_to_end(key)
+                return _engines[key]
+        options = {**ENGINE_OPTIONS, **options}
+        try:
+            engine = RAGEngine(
+                directory_path, vector_store_path, file_registry_path,
+                initial_refresh=initial_refresh,
+                embeddings=get_shared_embeddings(options["embedding_batch_size"], options["embedding_threads"]),
+                **options
+            )
+            with _engines_lock:
+                _engines[key] = engine
+                evicted = evict_engines(ENGINE_MEMORY_CAP, keep=key)
+        finally:
+            with _engines_lock:
+                _engines_loading.pop(key, None)
+    # Closing waits for any refresh in progress, so do it without holding the lock
+    for old_engine in evicted:
+        old_engine.close()
+    return engine
+
+def evict_engines(memory_cap, keep=None):
+    """
+    Drop least recently used engines from the registry until the loaded indexes
+    fit in memory_cap bytes (call with _engines_lock held)
+
+    Returns:
+        list: The evicted engines, for the caller to close() once the lock is released
+    """
+    usage = {key: engine.memory_usage() for key, engine in _engines.items()}
+    total = sum(usage.values())
+    evicted = []
+    for key in list(_engines):
+        if total <= memory_cap:
+            break
+        if key == keep or key in _pinned_engines:
+            continue
+        logger.info(f"Evicting RAG engine for {key[0]} ({usage[key] / 1e6:.1f} MB)")
+        evicted.append(_engines.pop(key))
+        total -= usage[key]
+    return evicted
+
+def get_collection_engine(collection=None, initial_refresh=True, pin=False, **options):
+    """Shared RAGEngine of a named collection (the default collection if None)"""
+    directory_path, vector_store_path, file_registry_path = collection_paths(collection)
+    return get_engine(directory_path, vector_store_path, file_registry_path, initial_refresh=initial_refresh, pin=pin, **options)
+
+def refresh(directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.db"):
+    """Pick up document changes in the shared engine for the given paths"""
+    return get_engine(directory_path, vector_store_path, file_registry_path).refresh()
+
         
-def RAG(prompt, directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.json"):
+def RAG(prompt, directory_path="documents", vector_store_path="vector_store", file_registry_path="file_registry.db",
+        token_budget=None, tokenizer=None, collection=None, filter=None, rerank=None, **options):
     """
-    Retrieval-Augmented Generation function that only processes new or changed files
+    Retrieval-Augmented Generation function backed by the shared RAGEngine.
+
+    The engine loads the embedder and vector store once per process and only
+    reads the store saved on disk; keeping it in sync with the documents is up
+    to a background indexer (see indexer.start_indexer) or an explicit refresh().
     
     Args:
         prompt: The user's prompt/question
         directory_path: Path to the directory containing documents
         vector_store_path: Path to save/load the vector store
         file_registry_path: Path to save/load the file registry
+        token_budget: Maximum number of context tokens, or None for no limit
+        tokenizer: Tokenizer of the generating model, used to measure the budget
+        collection: Named collection to search; overrides the three paths above
+        filter: Optional metadata filter, e.g. {"source": "case.pdf"} or {"page": {"gte": 3, "lte": 7}}
+        rerank: Rerank the candidates with the cross-encoder; defaults to the engine's
+                setting (RAG_RERANK)
+        **options: RAGEngine settings overriding ENGINE_OPTIONS if this call loads the engine
         
     Returns:
         Enriched prompt with relevant context
     """
-    # Check if vector store exists
-    vector_store_exists = os.path.exists(os.path.join(vector_store_path, "index.faiss"))
-    
-    # Process documents and create/update vector store
-    processor = DocumentProcessor(directory_path)
-    
-    # Process the directory, skipping unchanged files
-    processor.process_directory(file_registry_path)
-    
-    # Create or update vector store
-    vector_store = processor.create_vector_store(
-        save_path=vector_store_path,
-        update_existing=vector_store_exists
-    )
-    
-    # Create RAG system
-    rag_system = RAGSystem(vector_store=vector_store)
-    
-    # Query the RAG system
-    enriched_prompt = rag_system.query(prompt).replace("\n","").strip()
-    return enriched_prompt
\ No newline at end of file
+    if collection is not None:
+        directory_path, vector_store_path, file_registry_path = collection_paths(collection)
+    # Never index on the query path: open what the indexer last saved
+    engine = get_engine(directory_path, vector_store_path, file_registry_path, initial_refresh=False, **options)
+    engine.load()
+    enriched_prompt = engine.query(prompt, token_budget=token_budget, tokenizer=tokenizer, filter=filter, rerank=rerank).replace("\n","").strip()
+    return enriched_prompt
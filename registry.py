@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FileRegistry:
+    """
+    Content-addressed registry of processed files, backed by SQLite.
+
+    Extracted text is stored once per content hash in a zlib-compressed blob table.
+    Files and their segments (pages, or the whole file) only reference those blobs,
+    so identical files or pages share storage. Every update touches the rows of a
+    single file, and text is only read back when a segment is actually needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                stat_key TEXT,
+                content_hash TEXT,
+                processed_time REAL,
+                chunk_ids TEXT
+            );
+            CREATE TABLE IF NOT EXISTS segments (
+                name TEXT,
+                position INTEGER,
+                page INTEGER,
+                hash TEXT,
+                blob TEXT,
+                PRIMARY KEY (name, position)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data BLOB
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def names(self):
+        """Names of all registered files"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT name FROM files")]
+
+    def get(self, name):
+        """
+        Look up a file entry without loading any text
+
+        Returns:
+            dict: {"stat_key", "content_hash", "processed_time", "chunk_ids"} or None
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT stat_key, content_hash, processed_time, chunk_ids FROM files WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "stat_key": row[0],
+            "content_hash": row[1],
+            "processed_time": row[2],
+            "chunk_ids": json.loads(row[3]) if row[3] else None
+        }
+
+    def segments(self, name, with_text=True):
+        """
+        Load the segments of a file in order
+
+        Args:
+            name: File name
+            with_text: Whether to decompress and return the segment text
+
+        Returns:
+            list: Segment dicts with "page", "hash" and (optionally) "text" keys
+        """
+        with self.lock:
+            if with_text:
+                rows = self.conn.execute(
+                    "SELECT s.page, s.hash, b.data FROM segments s JOIN blobs b ON b.hash = s.blob "
+                    "WHERE s.name = ? ORDER BY s.position", (name,)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT page, hash, NULL FROM segments WHERE name = ? ORDER BY position", (name,)
+                ).fetchall()
+        segments = []
+        for page, segment_hash, data in rows:
+            segment = {"page": page, "hash": segment_hash}
+            if with_text:
+                segment["text"] = zlib.decompress(data).decode("utf-8")
+            segments.append(segment)
+        return segments
+
+    def iter_segments(self, name, batch_size=16):
+        """
+        Stream the segments of a file in order, with their text
+
+        Segments are read batch_size at a time, so a spreadsheet with thousands
+        of row groups is never held in memory at once.
+
+        Yields:
+            dict: Segment with "page", "hash" and "text" keys
+        """
+        position = -1
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT s.position, s.page, s.hash, b.data FROM segments s JOIN blobs b ON b.hash = s.blob "
+                    "WHERE s.name = ? AND s.position > ? ORDER BY s.position LIMIT ?", (name, position, batch_size)
+                ).fetchall()
+            for position, page, segment_hash, data in rows:
+                yield {"page": page, "hash": segment_hash, "text": zlib.decompress(data).decode("utf-8")}
+            if len(rows) < batch_size:
+                return
+
+    def segment_count(self, name):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM segments WHERE name = ?", (name,)).fetchone()[0]
+
+    def put(self, name, stat_key, content_hash, segments):
+        """
+        Insert or replace a file and its segments in a single transaction
+
+        segments may be a generator; it is consumed one segment at a time, and
+        an exception raised by it rolls the whole file back.
+        """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE name = ?", (name,))
+            for position, segment in enumerate(segments):
+                text = segment["text"].encode("utf-8")
+                blob_hash = hashlib.sha256(text).hexdigest()
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)",
+                    (blob_hash, zlib.compress(text))
+                )
+                self.conn.execute(
+                    "INSERT INTO segments (name, position, page, hash, blob) VALUES (?, ?, ?, ?, ?)",
+                    (name, position, segment.get("page"), segment.get("hash"), blob_hash)
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (name, stat_key, content_hash, processed_time, chunk_ids) "
+                "VALUES (?, ?, ?, ?, NULL)",
+                (name, stat_key, content_hash, time.time())
+            )
+
+    def touch(self, name, stat_key):
+        """Record a new stat key for a file whose content did not change"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE files SET stat_key = ? WHERE name = ?", (stat_key, name))
+
+    def set_chunk_ids(self, name, chunk_ids):
+        """Record the vector store chunk ids that belong to a file"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE files SET chunk_ids = ? WHERE name = ?", (json.dumps(chunk_ids), name))
+
+    def delete(self, name):
+        """Remove a file and its segments"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE name = ?", (name,))
+            self.conn.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def collect_garbage(self):
+        """Drop blobs that are no longer referenced by any segment"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT blob FROM segments)")
+            return cursor.rowcount
+
+    def import_json(self, json_path):
+        """
+        Import a legacy file_registry.json
+
+        Legacy entries only carry an mtime/size stat key, which is kept so that
+        unchanged files are not re-extracted after the migration.
+        """
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading legacy registry {json_path}: {str(e)}")
+            return 0
+
+        for name, entry in legacy.items():
+            segments = entry.get("segments")
+            if segments is None:
+                segments = [{"page": None, "hash": None, "text": entry.get("content", "")}]
+            self.put(name, entry.get("hash"), None, segments)
+            if entry.get("chunk_ids"):
+                self.set_chunk_ids(name, entry["chunk_ids"])
+        logger.info(f"Imported {len(legacy)} files from legacy registry {json_path}")
+        return len(legacy)
@@ -0,0 +1,77 @@
+import time
+import hashlib
+import logging
+import numpy as np
+from sentence_transformers import CrossEncoder
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class Reranker:
+    """
+    Cross-encoder reranking of retrieved candidates.
+
+    All uncached (query, chunk) pairs of a query are scored in one batched
+    forward pass, and scores are cached by (query hash, chunk id) so repeated
+    prompts only pay for chunks they have not seen.
+    """
+    def __init__(self, model_name=RERANK_MODEL_NAME, cache_size=4096, max_length=512, device="cpu"):
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self.score_cache = LRUCache(cache_size)
+
+    @staticmethod
+    def query_hash(query):
+        return hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+    def score(self, query, docs):
+        """
+        Relevance scores of docs for a query
+
+        Args:
+            query: The user's prompt/question
+            docs: Candidate documents
+
+        Returns:
+            list: One score per document
+        """
+        return self._score(query, docs)[0]
+
+    def _score(self, query, docs):
+        query_key = self.query_hash(query)
+        scores = [None] * len(docs)
+        pending = []
+        for i, doc in enumerate(docs):
+            chunk_id = doc.metadata.get("chunk_id") or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+            cached = self.score_cache.get((query_key, chunk_id))
+            if cached is None:
+                pending.append((i, chunk_id))
+            else:
+                scores[i] = cached
+
+        if pending:
+            pairs = [(query, docs[i].page_content) for i, _ in pending]
+            predicted = np.atleast_1d(self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False))
+            for (i, chunk_id), value in zip(pending, predicted.tolist()):
+                scores[i] = value
+                self.score_cache.put((query_key, chunk_id), value)
+        return scores, len(pending)
+
+    def rerank(self, query, docs, k=3):
+        """
+        Reorder candidates by cross-encoder score and keep the top k
+
+        Returns:
+            tuple: (top k documents, timing dict with rerank_ms, candidates and scored)
+        """
+        start = time.perf_counter()
+        scores, scored = self._score(query, docs)
+        ranked = [doc for _, doc in sorted(zip(scores, docs), key=lambda pair: pair[0], reverse=True)]
+        timing = {
+            "rerank_ms": (time.perf_counter() - start) * 1000,
+            "candidates": len(docs),
+            "scored": scored,
+        }
+        return ranked[:k], timing
@@ -0,0 +1,238 @@
+import math
+import time
+import logging
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# Corpus sizes (in chunks) below which index_type="auto" picks each index type
+AUTO_INDEX_THRESHOLDS = [
+    (50_000, "flat"),
+    (1_000_000, "ivf_flat"),
+    (None, "ivf_pq"),
+]
+
+# IVF and PQ need enough training points per centroid to be worth building
+MIN_TRAINING_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS_PER_CENTROID = 256
+
+
+def choose_index_type(n_vectors, index_type="auto"):
+    """Resolve "auto" to a concrete index type for a corpus of n_vectors chunks"""
+    if index_type != "auto":
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}. Expected one of {INDEX_TYPES} or 'auto'")
+        return index_type
+    for limit, candidate in AUTO_INDEX_THRESHOLDS:
+        if limit is None or n_vectors < limit:
+            return candidate
+    return "flat"
+
+
+def index_type_of(index):
+    """Name of the index type of a FAISS index"""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    return "flat"
+
+
+def plan_index(index_type, n_vectors):
+    """
+    Index type and IVF list count actually used for a corpus of n_vectors chunks
+
+    IVF types fall back to smaller variants (and finally flat) when the corpus is
+    too small to train them.
+
+    Returns:
+        tuple: (index_type, nlist)
+    """
+    nlist = 0
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = max(1, int(4 * math.sqrt(n_vectors)))
+        if n_vectors < nlist * MIN_TRAINING_POINTS_PER_CENTROID:
+            nlist = max(1, n_vectors // MIN_TRAINING_POINTS_PER_CENTROID)
+        if index_type == "ivf_pq" and n_vectors < 256 * MIN_TRAINING_POINTS_PER_CENTROID:
+            # 8-bit PQ codebooks need at least ~10k training points
+            index_type = "ivf_flat"
+        if nlist < 2:
+            index_type = "flat"
+    return index_type, nlist
+
+
+def build_index(index_type, vectors):
+    """
+    Build, train and fill a FAISS index of the given type
+
+    Args:
+        index_type: One of INDEX_TYPES
+        vectors: float32 array of shape (n, dim)
+
+    Returns:
+        faiss.Index: The populated index (falls back to flat if the corpus is too
+                     small to train the requested type)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index_type, nlist = plan_index(index_type, n)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32)
+        index.hnsw.efConstruction = 80
+        index.hnsw.efSearch = 64
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            # Largest sub-quantizer count that divides dim with at least 4 dims each
+            m = max(d for d in range(1, dim // 4 + 1) if dim % d == 0)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, 8)
+        sample_size = min(n, nlist * MAX_TRAINING_POINTS_PER_CENTROID)
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        logger.info(f"Training {index_type} index with {nlist} lists on {len(sample)} vectors")
+        index.train(sample)
+        index.nprobe = min(nlist, 16)
+
+    if n:
+        index.add(vectors)
+    return index
+
+
+def store_vectors(vector_store, embeddings=None):
+    """
+    Vectors of a vector store in position order
+
+    Flat and HNSW indexes are reconstructed directly; compressed or inverted
+    indexes are re-embedded through embeddings, which is cheap when it is a
+    CachedEmbeddings with every chunk already cached.
+    """
+    index = vector_store.index
+    n = index.ntotal
+    if n == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    try:
+        return index.reconstruct_n(0, n)
+    except RuntimeError:
+        if embeddings is None:
+            raise
+        ids = [vector_store.index_to_docstore_id[i] for i in range(n)]
+        texts = [vector_store.docstore.search(doc_id).page_content for doc_id in ids]
+        return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def rebuild_vector_store(vector_store, index_type, embeddings=None):
+    """Rebuild a vector store on a new index type, keeping its docstore and id mapping"""
+    vectors = store_vectors(vector_store, embeddings)
+    index = build_index(index_type, vectors)
+    logger.info(f"Rebuilt vector store as {index_type_of(index)} with {index.ntotal} vectors")
+    return FAISS(
+        embedding_function=vector_store.embedding_function,
+        index=index,
+        docstore=vector_store.docstore,
+        index_to_docstore_id=dict(vector_store.index_to_docstore_id),
+    )
+
+
+def delete_from_store(vector_store, ids, embeddings=None):
+    """
+    Delete chunk ids from a vector store
+
+    Only flat indexes renumber their vectors on removal the way the langchain
+    wrapper expects, so other index types are rebuilt without the deleted ids.
+
+    Returns:
+        FAISS: The updated vector store (a new object for non-flat indexes)
+    """
+    if not ids:
+        return vector_store
+    index_type = index_type_of(vector_store.index)
+    if index_type == "flat":
+        vector_store.delete(ids)
+        return vector_store
+
+    vectors = store_vectors(vector_store, embeddings)
+    deleted = set(ids)
+    keep = [i for i in range(vector_store.index.ntotal) if vector_store.index_to_docstore_id[i] not in deleted]
+    stored = set(vector_store.index_to_docstore_id.values())
+    vector_store.docstore.delete([doc_id for doc_id in deleted if doc_id in stored])
+    index = build_index(index_type, vectors[keep])
+    return FAISS(
+        embedding_function=vector_store.embedding_function,
+        index=index,
+        docstore=vector_store.docstore,
+        index_to_docstore_id={new: vector_store.index_to_docstore_id[old] for new, old in enumerate(keep)},
+    )
+
+
+def ensure_index_type(vector_store, index_type="auto", embeddings=None):
+    """
+    Rebuild the vector store if its index type no longer matches the target for its size
+
+    Returns:
+        tuple: (vector_store, rebuilt) where rebuilt tells whether a new index was built
+    """
+    n_vectors = vector_store.index.ntotal
+    target, _ = plan_index(choose_index_type(n_vectors, index_type), n_vectors)
+    if index_type_of(vector_store.index) == target:
+        return vector_store, False
+    logger.info(f"Corpus of {vector_store.index.ntotal} chunks moving to a {target} index")
+    # Not evaluated here: evaluate_index holds a second full copy of the vectors
+    # (see bench_rag.py for the recall of each index type)
+    return rebuild_vector_store(vector_store, target, embeddings), True
+
+
+def evaluate_index(vector_store, query_vectors=None, k=10, n_queries=100, embeddings=None):
+    """
+    Report recall and latency of a vector store's index against an exact flat baseline
+
+    Reconstructs (or re-embeds) every vector and builds a flat index over them,
+    so it needs about twice the index's memory; meant for benchmarks, not for
+    the indexing path.
+
+    Args:
+        vector_store: The vector store to evaluate
+        query_vectors: Optional float32 array of queries; defaults to a sample of stored vectors
+        k: Number of neighbours compared
+        n_queries: Number of stored vectors sampled when no queries are given
+        embeddings: Used to recover vectors of indexes that cannot be reconstructed
+
+    Returns:
+        dict: index_type, k, recall, latency_ms and flat_latency_ms per query, or None for an empty store
+    """
+    vectors = store_vectors(vector_store, embeddings)
+    if len(vectors) == 0:
+        return None
+    if query_vectors is None:
+        rng = np.random.default_rng(0)
+        query_vectors = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    start = time.perf_counter()
+    _, exact = flat.search(query_vectors, k)
+    flat_latency = (time.perf_counter() - start) / len(query_vectors)
+
+    start = time.perf_counter()
+    _, approx = vector_store.index.search(query_vectors, k)
+    latency = (time.perf_counter() - start) / len(query_vectors)
+
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx.tolist(), exact.tolist()))
+    return {
+        "index_type": index_type_of(vector_store.index),
+        "k": k,
+        "recall": hits / (k * len(query_vectors)),
+        "latency_ms": latency * 1000,
+        "flat_latency_ms": flat_latency * 1000,
+    }
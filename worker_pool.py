@@ -0,0 +1,97 @@
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Workers start from a fresh interpreter instead of a fork of a parent that may
+# hold threads (background indexer, embedding model) and open connections
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# Modules the fork server imports once, so every worker (and every pool rebuilt
+# after a timeout) is a cheap fork instead of a fresh import of them
+_preloaded = ["__main__"]
+
+
+def run_with_deadline(function, jobs, workers, timeout, initializer=None, progress=None):
+    """
+    Run function(*job) for every job on a process pool, with a time limit per job
+
+    At most one job per worker is in flight, so a job starts as soon as it is
+    submitted and its deadline counts from then. When a job overruns, the pool
+    is terminated (killing the hung worker) and rebuilt, and the jobs that were
+    still running on it are submitted again.
+
+    Args:
+        function: Module-level function, so it can be pickled; keep its module light,
+                  since every worker imports it
+        jobs: List of argument tuples
+        workers: Number of worker processes
+        timeout: Seconds a single job may run
+        initializer: Optional callable run once in each worker
+        progress: Optional callback(done) after every finished job
+
+    Returns:
+        list: (result, error) per job, in the same order; error is None on
+              success, the raised exception, or a TimeoutError
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    if START_METHOD == "forkserver" and function.__module__ not in _preloaded:
+        # Only takes effect if the fork server is not running yet
+        _preloaded.append(function.__module__)
+        context.set_forkserver_preload(_preloaded)
+    results = [(None, None)] * len(jobs)
+    queue = deque(range(len(jobs)))
+    in_flight = {}
+    wake = threading.Event()
+    done = 0
+    pool = None
+    try:
+        while queue or in_flight:
+            if pool is None:
+                pool = context.Pool(processes=workers, initializer=initializer)
+            while queue and len(in_flight) < workers:
+                i = queue.popleft()
+                async_result = pool.apply_async(
+                    function, jobs[i],
+                    callback=lambda _: wake.set(),
+                    error_callback=lambda _: wake.set()
+                )
+                in_flight[i] = (async_result, time.monotonic() + timeout)
+
+            # Sleep until a job finishes or the earliest deadline passes
+            wake.wait(max(0.0, min(deadline for _, deadline in in_flight.values()) - time.monotonic()))
+            wake.clear()
+            now = time.monotonic()
+            expired = 0
+            for i, (async_result, deadline) in list(in_flight.items()):
+                if async_result.ready():
+                    try:
+                        results[i] = (async_result.get(), None)
+                    except Exception as e:
+                        results[i] = (None, e)
+                elif deadline <= now:
+                    results[i] = (None, TimeoutError(f"timed out after {timeout}s"))
+                    expired += 1
+                else:
+                    continue
+                del in_flight[i]
+                done += 1
+                if progress is not None:
+                    progress(done)
+
+            if expired:
+                # terminate() is the only way to stop a worker stuck in C code;
+                # the jobs that were running next to it start over on the new pool
+                logger.warning(f"Restarting worker pool after {expired} job(s) exceeded {timeout}s")
+                pool.terminate()
+                pool.join()
+                pool = None
+                queue.extendleft(reversed(list(in_flight)))
+                in_flight.clear()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return results